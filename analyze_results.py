@@ -2,40 +2,44 @@ import pandas as pd
 import numpy as np
 import extract_info
 import validate_preds
-import seaborn as sns
-import matplotlib.pyplot as plt
 
 '''
 Analyze results of predictions.
 '''
 
-def df_with_validated_results(csv_path="report_text.csv"):
+def df_with_validated_results(csv_path="report_text.csv", workers=1):
     '''
     Produces dataframe with validated results from a csv.
-    If csv isn't provided, uses report_text.csv.
+    If csv isn't provided, uses report_text.csv. The typed Parquet dataset
+    written by make_df (a path ending in .parquet) loads faster.
     Inputs:
-        csv_path (str): filepath for csv
-    '''
-    df = pd.read_csv(csv_path)
-    df = gen_merged_df(df)
+        csv_path (str): filepath for csv or Parquet dataset
+        workers (int): the number of processes used for NLP annotation
+    '''
+    if csv_path.endswith('.parquet'):
+        df = pd.read_parquet(csv_path, columns=['YEAR', 'MONTH', 'COUNTRY', 'SITUATION', 'FORECAST', 'REGION'])
+    else:
+        df = pd.read_csv(csv_path)
+    df = gen_merged_df(df, workers)
     df = gen_results_df(df)
 
     return add_totals(df)
 
 
-def gen_merged_df(df):
+def gen_merged_df(df, workers=1):
     '''
     Takes a dataframe and creates a merged dataframe through self-joins
     such that a forecast is matched up to its two corresponding situations.
-    Converts situation and forecast text to nlp objects.
+    Converts situation and forecast text to the compact entity features
+    validation uses (see extract_info.annotate_features).
     Inputs:
         df: a Pandas dataframe where each row represents a country 
             in a particular month
+        workers (int): the number of processes used for NLP annotation
     Returns:
         a merged dataframe!
     '''
-    df = extract_info.get_snippets(df, 'SITUATION')
-    df = extract_info.get_snippets(df, 'FORECAST')
+    df = extract_info.annotate_features(df, ['SITUATION', 'FORECAST'], workers)
     df = extract_info.prelim_cleaning(df)
     return validate_preds.make_merged_df(df)
      
@@ -112,6 +116,8 @@ def confusion_matrix(df, results_col, sig_preds_col, title):
         Returns:
             None, but displays a confusion matrix heat map analyzing results
     '''
+    import seaborn as sns # plotting libraries are only imported when a chart is drawn
+    import matplotlib.pyplot as plt
     ax = plt.axes()
     pred_correct = np.concatenate(df[results_col].reset_index(drop=True))
     pred_sig_pred = np.concatenate(df[sig_preds_col].reset_index(drop=True)) 
@@ -128,6 +134,7 @@ def raw_counts_graph(df):
     Inputs:
         df: a Pandas dataframe
     '''
+    import matplotlib.pyplot as plt
     fig, axes = plt.subplots(nrows=3, ncols=1, sharex=True, figsize=(10, 10))
     df.groupby('YEAR').total_true_any.sum().plot(ax=axes[0])
     df.groupby('YEAR').total_false_any.sum().plot(ax=axes[0])
@@ -155,6 +162,7 @@ def percent_type_graph(df):
     Inputs:
         df: a Pandas dataframe
     '''
+    import matplotlib.pyplot as plt
     fig, axes = plt.subplots(nrows=3, ncols=1, sharex=True, figsize=(10, 10))
     df.groupby('YEAR').any_by_place_pct_true.mean().plot(ax=axes[0])
     df.groupby('YEAR').any_by_place_pct_false.mean().plot(ax=axes[0])
@@ -0,0 +1,192 @@
+'''
+Local annotation service that keeps the NLP pipeline warm between scripts and
+notebook sessions. Start it with python annotation_service.py, then call
+annotate to get the compact entity features validate_preds uses, without
+loading the model each time.
+
+The service listens on loopback HTTP. POST /annotate takes
+{"items": [[id, text], ...]} and returns {"results": [[id, doc], ...]}, where
+doc is a list of sentences of entity tuples in extract_info.Entity field order
+(null for empty texts). Requests are queued and annotated together in batches;
+when the queue is full the service answers 503 and the client retries.
+'''
+import argparse
+import json
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import extract_info
+
+HOST = '127.0.0.1'
+PORT = 8765
+BATCH_SIZE = 256 # texts annotated together
+MAX_QUEUE = 32 # requests waiting to be annotated before new ones are turned away
+MAX_ITEMS = 5000 # texts per request
+RETRY_AFTER = 1 # seconds a client should wait when the queue is full
+
+
+class Job:
+    '''
+    One request waiting to be annotated.
+    '''
+    def __init__(self, items):
+        self.items = items
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''
+    Answers annotation and health requests, handing annotation to the server's job queue.
+    '''
+    def do_GET(self):
+        if self.path != '/health':
+            return self.send_json(404, {'error': 'not found'})
+        self.send_json(200, {'profile': extract_info.PROFILE, 'queued': self.server.jobs.qsize(),
+                             'fingerprint': extract_info.pipeline_fingerprint(extract_info.PROFILE)})
+
+    def do_POST(self):
+        if self.path != '/annotate':
+            return self.send_json(404, {'error': 'not found'})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            items = [(item_id, str(text)) for item_id, text in body['items']]
+        except (ValueError, KeyError, TypeError):
+            return self.send_json(400, {'error': 'expected {"items": [[id, text], ...]}'})
+        if len(items) > MAX_ITEMS:
+            return self.send_json(413, {'error': 'at most ' + str(MAX_ITEMS) + ' items per request'})
+        job = Job(items)
+        try:
+            self.server.jobs.put_nowait(job)
+        except queue.Full:
+            return self.send_json(503, {'error': 'queue full'}, {'Retry-After': str(RETRY_AFTER)})
+        job.done.wait()
+        if job.error:
+            return self.send_json(500, {'error': job.error})
+        self.send_json(200, {'results': job.results})
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def run_jobs(jobs, batch_size=BATCH_SIZE):
+    '''
+    Annotates queued requests forever. Waits for a request, then takes any others
+    already queued, up to batch_size texts, and annotates their texts as one stream.
+    Inputs:
+        jobs: the queue of Jobs
+        batch_size (int): the number of texts to annotate together
+    '''
+    while True:
+        batch = [jobs.get()]
+        n_texts = len(batch[0].items)
+        while n_texts < batch_size:
+            try:
+                job = jobs.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(job)
+            n_texts += len(job.items)
+        try:
+            texts = [text for job in batch for item_id, text in job.items]
+            docs = extract_info.annotate_texts(texts, batch_size=batch_size,
+                                               convert=lambda doc: extract_info.compact_doc(doc) if doc else None)
+            for job in batch:
+                job.results = [(item_id, doc) for (item_id, text), doc in zip(job.items, docs)]
+        except Exception as e: # report the failure to the waiting clients rather than stopping the service
+            for job in batch:
+                job.error = repr(e)
+        for job in batch:
+            job.done.set()
+
+
+def make_server(host=HOST, port=PORT, batch_size=BATCH_SIZE, max_queue=MAX_QUEUE):
+    '''
+    Builds the pipeline and starts the annotation thread of a service.
+    Inputs:
+        host (str): the address to listen on
+        port (int): the port to listen on (0 picks a free one)
+        batch_size (int): the number of texts to annotate together
+        max_queue (int): the number of requests that may wait to be annotated
+    Returns:
+        the server; call serve_forever to answer requests
+    '''
+    extract_info.get_nlp()
+    extract_info.pipeline_fingerprint(extract_info.PROFILE)
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.jobs = queue.Queue(maxsize=max_queue)
+    threading.Thread(target=run_jobs, args=(server.jobs, batch_size), daemon=True).start()
+
+    return server
+
+
+def annotate(items, host=HOST, port=PORT, retries=30, timeout=600):
+    '''
+    Annotates texts with a running service.
+    Inputs:
+        items: a list of (id, text) pairs; ids must be JSON values
+        host (str): the address of the service
+        port (int): the port of the service
+        retries (int): how many times to retry while the service's queue is full
+        timeout (int): seconds to wait for a response
+    Returns:
+        a list of (id, CompactDoc) pairs in the order of items, with None for empty texts
+    '''
+    request = urllib.request.Request('http://' + host + ':' + str(port) + '/annotate',
+                                     data=json.dumps({'items': list(items)}).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    for attempt in range(retries + 1):
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                results = json.loads(response.read())['results']
+            break
+        except urllib.error.HTTPError as e:
+            if e.code != 503 or attempt == retries:
+                raise
+            time.sleep(float(e.headers.get('Retry-After', RETRY_AFTER)))
+
+    return [(item_id, to_compact_doc(doc)) for item_id, doc in results]
+
+
+def to_compact_doc(doc):
+    '''
+    Rebuilds a CompactDoc from its JSON form.
+    Inputs:
+        doc: a list of sentences of entity lists, or None
+    Returns:
+        a CompactDoc, or None
+    '''
+    if doc is None:
+        return None
+
+    return extract_info.CompactDoc(extract_info.CompactSentence(extract_info.Entity(*ent) for ent in sent)
+                                   for sent in doc)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves locust bulletin annotation from a warm pipeline.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='number of texts annotated together')
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE,
+                        help='number of requests that may wait before new ones get 503')
+    parser.add_argument('--profile', default=extract_info.PROFILE, choices=list(extract_info.PIPELINE_PROFILES))
+    args = parser.parse_args()
+    extract_info.PROFILE = args.profile
+    server = make_server(args.host, args.port, args.batch_size, args.max_queue)
+    print("annotating on http://" + args.host + ":" + str(server.server_port))
+    server.serve_forever()
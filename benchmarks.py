@@ -0,0 +1,607 @@
+'''
+Timing benchmarks for the text extraction and NLP pipeline.
+Run a benchmark from the command line, e.g. python benchmarks.py header_repair
+'''
+import gc
+import random
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+
+def time_call(func, *args, repeat=3):
+    '''
+    Times a function call.
+    Inputs:
+        func: the function to time
+        args: the arguments to call it with
+        repeat (int): the number of runs; the fastest is reported
+    Returns:
+        the fastest run time in seconds
+    '''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def make_long_page(n_lines, seed=0):
+    '''
+    Makes page text with split two-word country headers spread through body text.
+    Inputs:
+        n_lines (int): roughly how many lines the page should have
+        seed (int): the random seed
+    Returns:
+        the page text
+    '''
+    rng = random.Random(seed)
+    headers = [['C  S', 'HAD UDAN'], ['D.R. C', 'ONGO'], ['M  A', 'ALI LGERIA']]
+    body = ['No significant developments are likely.', 'Scattered adults were seen near Tamanrasset',
+            '• SITUATION', '• FORECAST', 'Small-scale breeding will occur in the winter areas.']
+    lines = []
+    while len(lines) < n_lines:
+        lines.extend(rng.choice(headers) if rng.random() < 0.1 else [rng.choice(body)])
+
+    return '\n'.join(lines)
+
+
+def quadratic_two_word(text):
+    '''
+    The previous get_text.two_word, which rewrites the whole text for every header.
+    Kept only as a baseline for bench_header_repair.
+    '''
+    line_list = text.split('\n')
+    for i, line in enumerate(line_list):
+        if re.match(r'[A-Z]  [A-Z]$', line):
+            next_line = line_list[i + 1]
+            next_line_list = next_line.split(" ")
+            country = " ".join(first + next_line_list[n] for n, first in enumerate(line.split("  ")))
+            text = text.replace(line + '\n' + next_line, country)
+        elif line == "D.R. C":
+            text = text.replace(line + '\n' + line_list[i + 1], "DR CONGO")
+
+    return text
+
+
+def bench_header_repair(sizes=(1000, 10000, 50000)):
+    '''
+    Compares single-pass get_text.two_word with the previous quadratic version,
+    and times the many_countries scan, on pages of increasing length.
+    Inputs:
+        sizes: the page lengths in lines
+    '''
+    import get_text
+    for n_lines in sizes:
+        page = make_long_page(n_lines)
+        old = time_call(quadratic_two_word, page, repeat=1)
+        new = time_call(get_text.two_word, page)
+        many = time_call(get_text.many_countries, page)
+        print("lines: ", n_lines, " two_word old: ", round(old, 4), "s new: ", round(new, 4),
+              "s speedup: ", round(old / new, 1), "x many_countries: ", round(many, 4), "s")
+
+    return None
+
+
+def make_long_bulletin(n_countries, seed=0):
+    '''
+    Makes bulletin text with n_countries labeled country sections.
+    Inputs:
+        n_countries (int): the number of country sections
+        seed (int): the random seed
+    Returns:
+        the bulletin text
+    '''
+    rng = random.Random(seed)
+    names = ['MAURITANIA', 'MALI, NIGER AND CHAD', 'SYRIA\nAND TURKEY', 'EASTERN REGION\nIRAN']
+    body = ['Scattered adults were seen near Tamanrasset', 'and in the Adrar des Iforas',
+            'No significant developments are likely.', 'Small-scale breeding will occur.']
+    lines = []
+    for _ in range(n_countries):
+        lines.append(rng.choice(names))
+        lines.append('• SITUATION')
+        lines.extend(rng.choice(body) for _ in range(rng.randint(1, 6)))
+        lines.append('• FORECAST')
+        lines.extend(rng.choice(body) for _ in range(rng.randint(1, 6)))
+        lines[-1] = lines[-1].rstrip('.') + '.'
+
+    return '\n'.join(lines)
+
+
+def regex_get_countries(text):
+    '''
+    The previous make_df.get_countries, which scans the text with a backtracking regex.
+    Kept only as a baseline for bench_get_countries.
+    '''
+    return re.findall(r'(.+?)(?:\n(?:  )?• SITUATION ? ?\n(.+?))?\n(?: +)?• FORECAST ?\n(.+?)(?=$|[^.]+(?:\n(?:  )?• SITUATION ? ?\n.+)?\n(?: +)?• FORECAST)', 
+                      text, re.DOTALL|re.IGNORECASE)
+
+
+def bench_get_countries(sizes=(25, 100, 400)):
+    '''
+    Compares the line-scanning make_df.get_countries with the previous regex,
+    on bulletins with increasing numbers of countries, and checks they agree.
+    Inputs:
+        sizes: the numbers of country sections
+    '''
+    import make_df
+    for n_countries in sizes:
+        text = make_long_bulletin(n_countries)
+        assert make_df.get_countries(text) == regex_get_countries(text), "parsers disagree"
+        old = time_call(regex_get_countries, text, repeat=1)
+        new = time_call(make_df.get_countries, text)
+        print("countries: ", n_countries, " regex: ", round(old, 4), "s scan: ", round(new, 4),
+              "s speedup: ", round(old / new, 1), "x")
+
+    return None
+
+
+def bench_make_df(root_dir=None):
+    '''
+    Times parsing the whole archive into rows with make_df.parse_text, and
+    checks that prep_text runs exactly once on each situation and forecast.
+    Inputs:
+        root_dir (str): the directory containing the year directories
+            (defaults to make_df.ROOT_DIR)
+    '''
+    import make_df
+    file_paths = make_df.get_file_paths(root_dir or make_df.ROOT_DIR)
+    prep_text = make_df.prep_text
+    calls = [0]
+
+    def counting_prep_text(year, month, text):
+        calls[0] += 1
+        return prep_text(year, month, text)
+
+    make_df.prep_text = counting_prep_text
+    try:
+        start = time.perf_counter()
+        frames = [make_df.parse_text(file_path, {}) for file_path in file_paths]
+        elapsed = time.perf_counter() - start
+    finally:
+        make_df.prep_text = prep_text
+    n_rows = sum(len(frame) for frame in frames)
+    print("files: ", len(file_paths), " rows: ", n_rows, " time: ", round(elapsed, 2), "s")
+    print("prep_text calls: ", calls[0], " expected: ", 2 * n_rows)
+    assert calls[0] == 2 * n_rows, "prep_text should run once per situation and forecast"
+
+    return None
+
+
+def load_texts(csv_path='report_text.csv', n_rows=None):
+    '''
+    Loads the situation and forecast texts, in the combined order used by extract_info.annotate.
+    Inputs:
+        csv_path (str): the bulletin csv
+        n_rows (int): how many rows to use (defaults to all)
+    Returns:
+        a list of texts
+    '''
+    import pandas as pd
+    df = pd.read_csv(csv_path, nrows=n_rows)
+
+    return [str(text) for col in ['SITUATION', 'FORECAST'] for text in df[col]]
+
+
+def entity_tuples(doc):
+    '''
+    Gives a doc's entities and custom attributes, for comparing runs.
+    '''
+    return [(ent.text, ent.label_, ent._.subject_decline, ent._.contains_adults, ent._.ent_solitarious,
+             tuple(token._.is_solitarious for token in ent)) for ent in doc.ents]
+
+
+def bench_annotate(worker_counts=(1, 2, 4), n_rows=2000, batch_size=250):
+    '''
+    Times extract_info.annotate_texts with different numbers of worker processes,
+    and checks every run gives the same entities and attributes.
+    Inputs:
+        worker_counts: the numbers of workers to try
+        n_rows (int): how many csv rows to annotate
+        batch_size (int): the number of texts per batch
+    '''
+    import extract_info
+    texts = load_texts(n_rows=n_rows)
+    extract_info.get_nlp()
+    expected = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        ents = [entity_tuples(doc) for doc in extract_info.annotate_texts(texts, workers, batch_size)]
+        elapsed = time.perf_counter() - start
+        if expected is None:
+            expected = ents
+        assert ents == expected, "annotations differ with " + str(workers) + " workers"
+        print("workers: ", workers, " docs: ", len(texts), " time: ", round(elapsed, 2),
+              "s docs/sec: ", round(len(texts) / elapsed, 1))
+
+    return None
+
+
+def traced_memory(func, *args):
+    '''
+    Measures the memory used by a function call.
+    Inputs:
+        func: the function to call
+        args: the arguments to call it with
+    Returns:
+        the result, the bytes allocated during the call that are still in use,
+        and the most bytes in use at once during the call
+    '''
+    gc.collect()
+    tracemalloc.start()
+    result = func(*args)
+    gc.collect()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, held, peak
+
+
+def bench_features(n_rows=2000):
+    '''
+    Compares the memory held, and the peak memory, of annotated spaCy docs with
+    the compact entity features that replace them, and checks validation gives
+    the same results on both.
+    Inputs:
+        n_rows (int): how many csv rows to annotate
+    '''
+    import pandas as pd
+    import analyze_results
+    import extract_info
+    import validate_preds
+    df = pd.read_csv('report_text.csv', nrows=n_rows)
+    extract_info.get_nlp()
+    docs_df, docs_held, docs_peak = traced_memory(lambda: extract_info.annotate(df.copy(), use_cache=False))
+    compact_df, compact_held, compact_peak = traced_memory(
+        lambda: extract_info.annotate_features(df.copy(), use_cache=False))
+    features = extract_info.features_table(list(compact_df['SITUATION']) + list(compact_df['FORECAST']))
+    table_held = features.memory_usage(index=True, deep=True).sum()
+    print("held: docs: ", round(docs_held / 2 ** 20, 1), "MB compact docs: ", round(compact_held / 2 ** 20, 1),
+          "MB (as a table: ", round(table_held / 2 ** 20, 1), "MB, ", len(features), " rows) reduction: ",
+          round(docs_held / compact_held, 1), "x")
+    print("peak: docs: ", round(docs_peak / 2 ** 20, 1), "MB compact docs: ", round(compact_peak / 2 ** 20, 1),
+          "MB reduction: ", round(docs_peak / compact_peak, 1), "x")
+    results = []
+    for annotated in [docs_df, compact_df]:
+        merged = validate_preds.make_merged_df(extract_info.prelim_cleaning(annotated))
+        results.append(analyze_results.gen_results_df(merged).drop(columns=['SITUATION', 'FORECAST', 'SIT_1', 'SIT_2']))
+    assert results[0].astype(str).equals(results[1].astype(str)), "validation differs on the compact features"
+
+    return None
+
+
+def time_components(nlp, texts, batch_size=1000):
+    '''
+    Runs texts through a pipeline one component at a time, timing each.
+    Inputs:
+        nlp: an nlp object
+        texts (list): the texts to annotate
+        batch_size (int): the number of texts per batch
+    Returns:
+        a list of (component name, seconds), starting with the tokenizer
+    '''
+    start = time.perf_counter()
+    docs = [nlp.make_doc(text) for text in texts]
+    timings = [('tokenizer', time.perf_counter() - start)]
+    for name, component in nlp.pipeline:
+        start = time.perf_counter()
+        if hasattr(component, 'pipe'):
+            docs = list(component.pipe(docs, batch_size=batch_size))
+        else:
+            docs = [component(doc) for doc in docs]
+        timings.append((name, time.perf_counter() - start))
+
+    return timings
+
+
+def bench_components(n_rows=2000, profiles=('full', 'trimmed')):
+    '''
+    Reports the time spent in each pipeline component on distinct archive texts,
+    and the throughput of each pipeline profile. Reports how many forecasts get
+    different validation results with each profile than with the first.
+    Inputs:
+        n_rows (int): how many csv rows to annotate
+        profiles: keys of extract_info.PIPELINE_PROFILES
+    '''
+    import pandas as pd
+    import analyze_results
+    import extract_info
+    import validate_preds
+    texts = list(dict.fromkeys(load_texts(n_rows=n_rows)))
+    df = pd.read_csv('report_text.csv', nrows=n_rows)
+    expected = None
+    for profile in profiles:
+        nlp = extract_info.shared_nlp(profile)
+        timings = time_components(nlp, texts)
+        total = sum(seconds for name, seconds in timings)
+        print("profile: ", profile, " docs: ", len(texts), " time: ", round(total, 2), "s docs/sec: ",
+              round(len(texts) / total, 1))
+        for name, seconds in timings:
+            print("    ", name, ": ", round(seconds, 3), "s (", round(100 * seconds / total, 1), "%)")
+        extract_info.PROFILE, previous = profile, extract_info.PROFILE
+        try:
+            annotated = extract_info.annotate_features(df.copy(), use_cache=False)
+        finally:
+            extract_info.PROFILE = previous
+        merged = validate_preds.make_merged_df(extract_info.prelim_cleaning(annotated))
+        results = analyze_results.gen_results_df(merged).drop(columns=['SITUATION', 'FORECAST', 'SIT_1', 'SIT_2'])
+        if expected is None:
+            expected = results
+        differ = (results.astype(str) != expected.astype(str)).any(axis=1)
+        print("    forecasts validated differently than with profile ", profiles[0], ": ", differ.sum(),
+              " of ", len(results))
+
+    return None
+
+
+def chain_subject_decline(doc):
+    '''
+    The previous extract_info.subject_decline component, which builds doc.ents
+    again for every entity. Kept only as a baseline for bench_attributes.
+    '''
+    for i, ent in enumerate(doc.ents):
+        if ent.label_ in ('ACTION', 'LOC_TYPE') and i < len(doc.ents) - 1:
+            if doc.ents[i + 1].root.lemma_ == 'decline' or doc.ents[i + 1].root.lemma_ == 'decrease':
+                ent._.subject_decline = True
+    return doc
+
+
+def chain_is_solitarious(doc):
+    '''
+    The previous extract_info.is_solitarious component, which walks every token.
+    Kept only as a baseline for bench_attributes.
+    '''
+    from extract_info import contains_sol_word
+    for token in doc:
+        if token.ent_type_ == 'LOC_TYPE':
+            if contains_sol_word(token):
+                token._.is_solitarious = True
+                continue
+            for child in token.children:
+                if contains_sol_word(child):
+                    token._.is_solitarious = True
+                    continue
+            for conj in token.conjuncts:
+                for child in conj.children:
+                    if contains_sol_word(child):
+                        token._.is_solitarious = True
+            if not token._.is_solitarious:
+                token._.is_solitarious = False
+    return doc
+
+
+def chain_contains_adults(doc):
+    '''
+    The previous extract_info.contains_adults component. Kept only as a baseline for bench_attributes.
+    '''
+    for ent in doc.ents:
+        if ent.label_ == 'LOC_TYPE':
+            ent._.contains_adults = 'adult' in ent.text
+    return doc
+
+
+def chain_ent_solitarious(doc):
+    '''
+    The previous extract_info.ent_solitarious component, which always ended up
+    marking entities False. Kept only as a baseline for bench_attributes.
+    '''
+    for ent in doc.ents:
+        for token in ent:
+            if token._.is_solitarious:
+                ent._.ent_solitarious = True
+        ent._.ent_solitarious = False
+    return doc
+
+
+CHAIN = [chain_subject_decline, chain_is_solitarious, chain_contains_adults, chain_ent_solitarious]
+
+
+def attribute_tuples(doc):
+    '''
+    Gives a doc's custom attributes, for comparing the fused component with the chain.
+    '''
+    return ([token._.is_solitarious for token in doc],
+            [(ent._.subject_decline, ent._.contains_adults) for ent in doc.ents])
+
+
+def run_chain(nlp, texts, repeat=1):
+    '''
+    Annotates texts with the chain of four components in the order the pipeline
+    used to run them: subject_decline after refine_entities, before merge_entities
+    and combine_ruler, and the other three after combine_ruler.
+    Inputs:
+        nlp: the shared nlp object
+        texts (list): the texts to annotate
+        repeat (int): the number of runs of each stage; the fastest is reported
+    Returns:
+        docs: the annotated docs
+        seconds: the time spent in the four components
+    '''
+    with nlp.disable_pipes('merge_entities', 'combine_ruler', 'entity_attributes'):
+        docs = list(nlp.pipe(texts))
+    early = time_call(lambda: [chain_subject_decline(doc) for doc in docs], repeat=repeat)
+    merge_entities, combine_ruler = nlp.get_pipe('merge_entities'), nlp.get_pipe('combine_ruler')
+    docs = [combine_ruler(merge_entities(doc)) for doc in docs]
+    late = time_call(lambda: [component(doc) for doc in docs for component in CHAIN[1:]], repeat=repeat)
+
+    return docs, early + late
+
+
+def bench_attributes(n_rows=2000, repeat=3):
+    '''
+    Compares extract_info.entity_attributes with the chain of four components it
+    replaced, each run where it sits in its own pipeline, on distinct archive texts.
+    Checks they mark the same token attributes, subject_decline and contains_adults,
+    and reports how many entities are now solitarious. subject_decline used to run
+    before combine_ruler, so a mark it put on an entity that combine_ruler then
+    widened (e.g. "immature and mature adults" to "scattered immature and mature
+    adults") was lost; the fused component runs after and keeps it. Those entities
+    are reported, not counted as mismatches.
+    Inputs:
+        n_rows (int): how many csv rows to use
+        repeat (int): the number of runs; the fastest is reported
+    '''
+    import extract_info
+    texts = list(dict.fromkeys(load_texts(n_rows=n_rows)))
+    nlp = extract_info.get_nlp()
+    chain_docs, chain = run_chain(nlp, texts, repeat)
+    with nlp.disable_pipes('entity_attributes'):
+        fused_docs = list(nlp.pipe(texts))
+    fused = time_call(lambda: [extract_info.entity_attributes(doc) for doc in fused_docs], repeat=repeat)
+    mismatches = 0
+    widened = 0
+    for old, new in zip(chain_docs, fused_docs):
+        (old_tokens, old_ents), (new_tokens, new_ents) = attribute_tuples(old), attribute_tuples(new)
+        if old_tokens != new_tokens or len(old_ents) != len(new_ents):
+            mismatches += 1
+            continue
+        if any(old_adults != new_adults or (old_decline and not new_decline)
+               for (old_decline, old_adults), (new_decline, new_adults) in zip(old_ents, new_ents)):
+            mismatches += 1
+            continue
+        widened += sum(1 for old_ent, new_ent in zip(old_ents, new_ents) if new_ent[0] and not old_ent[0])
+    solitarious = sum(1 for doc in fused_docs for ent in doc.ents if ent._.ent_solitarious)
+    print("docs: ", len(texts), " chain: ", round(chain, 3), "s fused: ", round(fused, 3), "s speedup: ",
+          round(chain / fused, 1), "x mismatches: ", mismatches, " solitarious entities: ", solitarious,
+          " declining entities widened by combine_ruler: ", widened)
+    assert not mismatches, "the fused component marks different attributes"
+
+    return None
+
+
+STARTUP_CODE = '''import time
+start = time.perf_counter()
+import extract_info
+extract_info.MODEL, extract_info.RULER_DIR = {model!r}, {ruler_dir!r}
+imported = time.perf_counter()
+nlp = extract_info.spacy.load(extract_info.MODEL)
+loaded = time.perf_counter()
+extract_info.make_entity_ruler(nlp)
+extract_info.combine_entities_ruler(nlp)
+rulers = time.perf_counter()
+extract_info.shared_nlp(extract_info.PROFILE)
+print(imported - start, loaded - imported, rulers - loaded, time.perf_counter() - rulers)
+'''
+
+
+def bench_startup(runs=3):
+    '''
+    Times what a freshly started worker process does before it can annotate:
+    importing extract_info, loading the model, building the entity rulers and
+    building the whole pipeline. The first run starts with an empty ruler cache,
+    so it validates and saves the patterns; later runs load them.
+    Inputs:
+        runs (int): the number of worker starts to time
+    '''
+    import tempfile
+    import extract_info
+    with tempfile.TemporaryDirectory() as ruler_dir:
+        code = STARTUP_CODE.format(model=extract_info.MODEL, ruler_dir=ruler_dir)
+        for run in range(runs):
+            result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+            if result.returncode != 0:
+                print("failed -", result.stderr.strip().split('\n')[-1])
+                return None
+            imported, loaded, rulers, pipeline = (float(x) for x in result.stdout.split()[-4:])
+            print("worker ", run + 1, " (ruler cache ", "cold" if run == 0 else "warm", "): import: ", round(imported, 3),
+                  "s model: ", round(loaded, 3), "s rulers: ", round(1000 * rulers, 1), "ms pipeline: ",
+                  round(pipeline, 3), "s")
+
+    return None
+
+
+def bench_service(n_rows=200, clients=8):
+    '''
+    Times requests to an annotation service running in this process: a batch of
+    archive texts, the same batch again, and a single text. Then sends batches
+    from several clients at once to a service whose queue holds one request, so
+    some are turned away and retried. Checks every result matches annotating locally.
+    Inputs:
+        n_rows (int): how many csv rows to send
+        clients (int): the number of clients sending at once
+    '''
+    import threading
+    import annotation_service
+    import extract_info
+    texts = load_texts(n_rows=n_rows)
+    items = list(enumerate(texts))
+    expected = [(i, extract_info.compact_doc(doc) if doc else None)
+                for i, doc in enumerate(extract_info.annotate_texts(texts, use_cache=False))]
+    server = annotation_service.make_server(port=0, max_queue=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+    try:
+        for name, batch in [('batch', items), ('same batch', items), ('one text', items[:1])]:
+            start = time.perf_counter()
+            results = annotation_service.annotate(batch, port=port)
+            elapsed = time.perf_counter() - start
+            assert results == expected[:len(batch)], "service results differ from local annotation"
+            print(name, ": ", len(batch), " texts in ", round(1000 * elapsed, 1), "ms")
+        outputs = [None] * clients
+        chunks = [items[i::clients] for i in range(clients)]
+
+        def send(n):
+            outputs[n] = annotation_service.annotate(chunks[n], port=port)
+
+        threads = [threading.Thread(target=send, args=(n,)) for n in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        assert outputs == [expected[n::clients] for n in range(clients)], "concurrent results differ"
+        print(clients, " clients at once: ", round(1000 * elapsed, 1), "ms")
+    finally:
+        server.shutdown()
+
+    return None
+
+
+IMPORT_MODULES = ['get_text', 'make_df', 'extract_info', 'validate_preds', 'location_matching',
+                  'analyze_results', 'annotation_service']
+
+
+def bench_imports(modules=IMPORT_MODULES):
+    '''
+    Times importing each module in a fresh interpreter, so nothing is already
+    loaded. Modules whose dependencies aren't installed are reported as failing.
+    Inputs:
+        modules: the module names
+    '''
+    for module in modules:
+        code = ("import time\nstart = time.perf_counter()\nimport " + module +
+                "\nprint(time.perf_counter() - start)")
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+        if result.returncode == 0:
+            print(module, ": ", round(float(result.stdout.split()[-1]), 3), "s")
+        else:
+            print(module, ": failed -", result.stderr.strip().split('\n')[-1])
+
+    return None
+
+
+BENCHMARKS = {
+    'annotate': bench_annotate,
+    'attributes': bench_attributes,
+    'components': bench_components,
+    'features': bench_features,
+    'header_repair': bench_header_repair,
+    'imports': bench_imports,
+    'startup': bench_startup,
+    'get_countries': bench_get_countries,
+    'make_df': bench_make_df,
+    'service': bench_service,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print("== ", name)
+        BENCHMARKS[name]()
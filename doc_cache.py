@@ -0,0 +1,126 @@
+'''
+On-disk cache of annotated docs, so validation can be re-run without running
+the NLP pipeline again. Records are keyed by a hash of the text and live in a
+directory named after the pipeline fingerprint, so changing the pipeline
+leaves the old records unused until they are evicted.
+'''
+import hashlib
+import os
+import tempfile
+
+CACHE_DIR = '.doc_cache'
+MAX_CACHE_BYTES = 1024 * 1024 * 1024
+
+
+def text_key(text):
+    '''
+    Gives the cache key of a text.
+    Inputs:
+        text (str): the text
+    Returns:
+        the hex digest of the text
+    '''
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def cache_path(key, fingerprint, cache_dir=CACHE_DIR):
+    '''
+    Gives the location of the cache record for a text.
+    Inputs:
+        key (str): the text key
+        fingerprint (str): the pipeline fingerprint
+        cache_dir (str): the cache directory
+    Returns:
+        the path of the record
+    '''
+    return os.path.join(cache_dir, fingerprint, key + '.spacy')
+
+
+def load(keys, fingerprint, cache_dir=CACHE_DIR):
+    '''
+    Loads the cache records for texts, marking them as recently used.
+    Inputs:
+        keys: the text keys
+        fingerprint (str): the pipeline fingerprint
+        cache_dir (str): the cache directory
+    Returns:
+        a dictionary of text key -> serialized DocBin, for the keys that are cached
+    '''
+    records = {}
+    for key in keys:
+        path = cache_path(key, fingerprint, cache_dir)
+        try:
+            with open(path, 'rb') as f:
+                records[key] = f.read()
+            os.utime(path)
+        except OSError:
+            continue
+
+    return records
+
+
+def save(records, fingerprint, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    '''
+    Saves cache records, then evicts old records if the cache is too big.
+    Inputs:
+        records: a dictionary of text key -> serialized DocBin
+        fingerprint (str): the pipeline fingerprint
+        cache_dir (str): the cache directory
+        max_bytes (int): the largest the cache may grow
+    '''
+    directory = os.path.join(cache_dir, fingerprint)
+    os.makedirs(directory, exist_ok=True)
+    for key, data in records.items():
+        fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, cache_path(key, fingerprint, cache_dir))
+    evict(cache_dir, max_bytes)
+
+    return None
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    '''
+    Deletes the least recently used records, whatever their fingerprint,
+    until the cache fits in max_bytes, then removes emptied fingerprint directories.
+    Inputs:
+        cache_dir (str): the cache directory
+        max_bytes (int): the largest the cache may grow
+    Returns:
+        the number of records deleted
+    '''
+    entries = []
+    directories = [entry.path for entry in os.scandir(cache_dir) if entry.is_dir()]
+    for directory in directories:
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.spacy'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for mtime, size, path in entries)
+    deleted = 0
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError: # already removed by another process
+            pass
+        total -= size
+        deleted += 1
+    for directory in directories:
+        try:
+            os.rmdir(directory)
+        except OSError: # not empty
+            pass
+
+    return deleted
+
+
+def clear(cache_dir=CACHE_DIR):
+    '''
+    Deletes every record in the cache.
+    Inputs:
+        cache_dir (str): the cache directory
+    '''
+    return evict(cache_dir, 0) if os.path.isdir(cache_dir) else 0
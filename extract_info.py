@@ -1,12 +1,33 @@
 import spacy
 from spacy.matcher import Matcher
-from spacy.tokens import Span, Token
+from spacy.tokens import Span, Token, DocBin
 from fuzzywuzzy import fuzz
 from spacy.pipeline import Sentencizer, EntityRuler
-from itertools import *
+from itertools import repeat
+from collections import Counter, namedtuple
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+import doc_cache
+import pandas as pd
+import hashlib
+import inspect
+import json
+import os
 import re
+import tempfile
+import time
 
-nlp = spacy.load("en_core_web_sm")
+MODEL = "en_core_web_sm"
+PIPELINE_PROFILES = { # built-in model components each profile leaves out
+    'full': [],
+    'trimmed': ['ner'], # the entity ruler runs first, and refine_entities drops most statistical entities
+}
+PROFILE = 'full'
+RULER_DIR = '.ruler_cache' # validated entity ruler pattern sets
+DOC_ATTRS = ['LEMMA', 'TAG', 'POS', 'DEP', 'HEAD', 'ENT_IOB', 'ENT_TYPE'] # annotations sent back from workers
+FEATURE_COLUMNS = ['doc_id', 'sentence', 'entity', 'label', 'lemma', 'text', 'negation',
+                   'subject_decline', 'contains_adults', 'ent_solitarious']
+FEATURE_LABELS = ('GEN_LOC', 'SPEC_LOC', 'ACTION', 'LOC_TYPE') # the entities validate_preds.get_data reads
 
 LOCUST_VERBS = ['mature', 'lay', 'lie', 'fledge', 'breed', 'hatch', 'copulate', 'fly', 
                 'decline', 'decrease', 'scatter', 'isolate']
@@ -17,6 +38,48 @@ MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'Augus
 DIRECTIONS = ['north', 'south', 'east', 'west', 'southwest', 'southeast', 'northwest', 'northeast']
     
 
+class Entity(namedtuple('Entity', ['text', 'label_', 'lemma_', 'negation', 'subject_decline',
+                                   'contains_adults', 'ent_solitarious'])):
+    '''
+    The features of one entity that validation uses. Reads like a spaCy span
+    (ent.text, ent.label_, ent._.contains_adults), so validate_preds works on either.
+    '''
+    __slots__ = ()
+
+    @property
+    def _(self):
+        return self
+
+    def __str__(self):
+        return self.text
+
+
+class CompactSentence(tuple):
+    '''
+    The entities of one sentence, standing in for a spaCy sentence span.
+    '''
+    __slots__ = ()
+
+    @property
+    def ents(self):
+        return self
+
+
+class CompactDoc(tuple):
+    '''
+    The sentences of one doc, standing in for a spaCy doc in validation.
+    '''
+    __slots__ = ()
+
+    @property
+    def sents(self):
+        return self
+
+    @property
+    def ents(self):
+        return tuple(ent for sent in self for ent in sent)
+
+
 def prep_text(year, month, text):
     '''
     Prepares text for processing.
@@ -36,13 +99,41 @@ def prep_text(year, month, text):
 
     return text
 
-def make_nlp():
+def get_nlp():
+    '''
+    Gives the shared nlp object for the current PROFILE, building it with
+    make_nlp the first time it's asked for, so the model is only loaded when text is processed.
+    Returns:
+        an nlp object
+    '''
+    return shared_nlp(PROFILE)
+
+
+@lru_cache(maxsize=None)
+def shared_nlp(profile):
+    '''
+    Gives the shared nlp object for a pipeline profile.
+    Inputs:
+        profile (str): a key of PIPELINE_PROFILES
+    Returns:
+        an nlp object
+    '''
+    return make_nlp(profile)
+
+
+def make_nlp(profile='full'):
     '''
     Generates spaCy nlp object and adds pipelines.
+    Use get_nlp to share one across calls.
+    Inputs:
+        profile (str): a key of PIPELINE_PROFILES, naming the built-in
+            components to leave out; the tagger and parser are always kept,
+            as the entity patterns match on POS and lemma and is_solitarious
+            walks the dependency tree
     Returns:
         an nlp object
     '''
-    nlp = spacy.load("en_core_web_sm")
+    nlp = spacy.load(MODEL, disable=PIPELINE_PROFILES[profile])
     sentencizer = Sentencizer(punct_chars=['.'])
     ruler = make_entity_ruler(nlp)
     Token.set_extension('is_solitarious', default=None, force=True)
@@ -52,48 +143,309 @@ def make_nlp():
     merge_ents = nlp.create_pipe("merge_entities")
     combine_ents_ruler = combine_entities_ruler(nlp)
     nlp.add_pipe(sentencizer, first=True)
-    nlp.add_pipe(ruler, before='ner')
+    nlp.add_pipe(ruler, after='parser')
     nlp.add_pipe(refine_entities)
-    nlp.add_pipe(subject_decline)
     nlp.add_pipe(merge_ents)
     nlp.add_pipe(combine_ents_ruler)
-    nlp.add_pipe(is_solitarious)
-    nlp.add_pipe(contains_adults)
-    nlp.add_pipe(ent_solitarious)
+    nlp.add_pipe(entity_attributes)
 
     return nlp
 
 
-def get_snippets(df, col_name, new_col_name=None):
+def get_snippets(df, col_name, new_col_name=None, workers=1, batch_size=1000, use_cache=True):
     '''
     Converts to column of text to column of nlp objects.
     Input:
         df: a Pandas dataframe
         col_name: either 'SITUATION' or 'FORECAST'
         new_col_name (string): the name of the column containing the snippets
+        workers (int): the number of processes to annotate with
+        batch_size (int): the number of texts per batch
+        use_cache (bool): whether to use the on-disk doc cache
     Returns:
         dataframe with specified col converted to nlp object
     '''
-    df.loc[:, col_name] = df[col_name].apply(str)
-    nlp = make_nlp()
-    if new_col_name:
-        df[new_col_name] = None
+    df[col_name] = df[col_name].apply(str)
     nlp_col = []
-    for i, doc in enumerate(nlp.pipe(iter(df[col_name].astype('str')), batch_size = 1000, n_threads=-1)):
+    snippets = []
+    texts = list(df[col_name].astype('str'))
+    for doc in annotate_texts(texts, workers, batch_size, use_cache):
         if not doc:
             nlp_col.append(None)
+            snippets.append(None)
             continue
         doc_ents = []
         for sent in doc.sents:
             doc_ents.append([ent for ent in sent.ents])
-        if new_col_name:
-            df.loc[i][new_col_name] = doc_ents       
+        snippets.append(doc_ents)
         nlp_col.append(doc)
-    df.loc[:, col_name] = nlp_col
+    # Series, as .loc would try to unpack the docs and lists into an array
+    if new_col_name:
+        df[new_col_name] = pd.Series(snippets, index=df.index, dtype=object)
+    df[col_name] = pd.Series(nlp_col, index=df.index, dtype=object)
     
     return df
 
 
+def annotate(df, col_names=('SITUATION', 'FORECAST'), workers=1, batch_size=1000, use_cache=True):
+    '''
+    Converts several columns of text to columns of nlp objects,
+    running all of their texts through the pipeline as one stream.
+    Inputs:
+        df: a Pandas dataframe
+        col_names: the columns to convert
+        workers (int): the number of processes to annotate with
+        batch_size (int): the number of texts per batch
+        use_cache (bool): whether to use the on-disk doc cache
+    Returns:
+        dataframe with the columns converted to nlp objects
+    '''
+    texts = []
+    for col_name in col_names:
+        df[col_name] = df[col_name].apply(str)
+        texts.extend(df[col_name])
+    docs = [doc if doc else None for doc in annotate_texts(texts, workers, batch_size, use_cache)]
+    for n, col_name in enumerate(col_names):
+        df[col_name] = pd.Series(docs[n * len(df):(n + 1) * len(df)], index=df.index, dtype=object)
+
+    return df
+
+
+def annotate_features(df, col_names=('SITUATION', 'FORECAST'), workers=1, batch_size=1000, use_cache=True):
+    '''
+    Like annotate, but keeps only what validation needs: each doc is turned
+    into a CompactDoc of its entity features as it comes out of the pipeline,
+    and the doc itself is dropped. features_table makes the columnar table
+    of the result, e.g. to save it.
+    Inputs:
+        df: a Pandas dataframe
+        col_names: the columns to convert
+        workers (int): the number of processes to annotate with
+        batch_size (int): the number of texts per batch
+        use_cache (bool): whether to use the on-disk doc cache
+    Returns:
+        the dataframe with the columns converted to CompactDocs
+    '''
+    texts = []
+    for col_name in col_names:
+        df[col_name] = df[col_name].apply(str)
+        texts.extend(df[col_name])
+    docs = list(annotate_texts(texts, workers, batch_size, use_cache,
+                               convert=lambda doc: compact_doc(doc) if doc else None))
+    for n, col_name in enumerate(col_names):
+        # a Series, as .loc would try to unpack the tuples into an array
+        df[col_name] = pd.Series(docs[n * len(df):(n + 1) * len(df)], index=df.index, dtype=object)
+
+    return df
+
+
+def compact_doc(doc):
+    '''
+    Extracts the entity features validation uses from a doc.
+    Inputs:
+        doc: an nlp doc object
+    Returns:
+        a CompactDoc with one CompactSentence of Entities per sentence
+    '''
+    return CompactDoc(CompactSentence(Entity(ent.text, ent.label_, ent.lemma_, ent[0].text.lower().startswith('no '),
+                                             ent._.subject_decline, ent._.contains_adults, ent._.ent_solitarious)
+                                      for ent in sent.ents if ent.label_ in FEATURE_LABELS)
+                      for sent in doc.sents)
+
+
+def features_table(docs):
+    '''
+    Makes the columnar feature table of a list of CompactDocs, one row per
+    (doc_id, sentence, entity). A sentence without entities gets a single
+    row with no entity, so compact_docs can restore it; docs that are None get no rows.
+    Inputs:
+        docs (list): CompactDocs (or None), where doc_id is the position in the list
+    Returns:
+        a Pandas dataframe with FEATURE_COLUMNS
+    '''
+    rows = []
+    for doc_id, doc in enumerate(docs):
+        for sentence, sent in enumerate(doc or []):
+            if not sent:
+                rows.append((doc_id, sentence, -1, None, None, None, None, None, None, None))
+            for entity, ent in enumerate(sent):
+                rows.append((doc_id, sentence, entity, ent.label_, ent.lemma_, ent.text, ent.negation,
+                             ent.subject_decline, ent.contains_adults, ent.ent_solitarious))
+    features = pd.DataFrame.from_records(rows, columns=FEATURE_COLUMNS)
+    features['label'] = features['label'].astype('category')
+
+    return features
+
+
+def compact_docs(features, n_docs):
+    '''
+    Rebuilds the CompactDocs from a feature table, e.g. one loaded from disk.
+    Inputs:
+        features: a feature table made by features_table
+        n_docs (int): the number of docs the table was made from
+    Returns:
+        a list of CompactDocs (or None), indexed by doc_id
+    '''
+    docs = [None] * n_docs
+    sentences = {}
+    for row in features.itertuples(index=False):
+        sent = sentences.setdefault((row.doc_id, row.sentence), [])
+        if row.entity != -1:
+            sent.append(Entity(row.text, row.label, row.lemma, row.negation, row.subject_decline,
+                               row.contains_adults, row.ent_solitarious))
+    doc_sents = {}
+    for (doc_id, sentence), ents in sorted(sentences.items()):
+        doc_sents.setdefault(doc_id, []).append(CompactSentence(ents))
+    for doc_id, sents in doc_sents.items():
+        docs[doc_id] = CompactDoc(sents)
+
+    return docs
+
+
+def annotate_texts(texts, workers=1, batch_size=1000, use_cache=True, convert=None):
+    '''
+    Runs texts through the shared pipeline, in this process or spread in
+    batches across worker processes. Docs from workers come back through a
+    DocBin with their user data, so the custom extension attributes survive.
+    Each distinct text is annotated once and its doc is shared by every copy;
+    texts already annotated by the same pipeline are loaded from the doc cache.
+    If convert is given, each doc is converted as soon as it is made and only
+    the result is kept, so the docs never all have to fit in memory at once.
+    Inputs:
+        texts (list): the texts to annotate
+        workers (int): the number of processes to use
+        batch_size (int): the number of texts per batch
+        use_cache (bool): whether to use the on-disk doc cache
+        convert: a function of a doc whose result is yielded in place of the doc
+    Returns:
+        a generator of docs (or their converted results), in the order of the texts
+    '''
+    convert = convert or (lambda doc: doc)
+    counts = Counter(texts)
+    print("distinct texts: ", len(counts), " of ", len(texts), " dedup ratio: ",
+          round(len(texts) / max(len(counts), 1), 2))
+    cached = {}
+    if use_cache:
+        vocab = get_nlp().vocab
+        fingerprint = pipeline_fingerprint(PROFILE)
+        keys = {text: doc_cache.text_key(text) for text in counts}
+        records = doc_cache.load(keys.values(), fingerprint)
+        cached = {text: records[key] for text, key in keys.items() if key in records}
+        print("docs from cache: ", len(cached), " of ", len(counts))
+    to_run = [text for text in counts if text not in cached]
+    results = {}
+    for text in list(cached):
+        results[text] = convert(doc_from_bytes(cached.pop(text), vocab))
+    if to_run:
+        start = time.perf_counter()
+        records = {}
+        for text, doc in zip(to_run, run_pipeline(to_run, workers, batch_size)):
+            if use_cache:
+                records[keys[text]] = doc_to_bytes(doc)
+                if len(records) == batch_size:
+                    doc_cache.save(records, fingerprint)
+                    records = {}
+            results[text] = convert(doc)
+        if records:
+            doc_cache.save(records, fingerprint)
+        elapsed = time.perf_counter() - start
+        # pipeline time grows with text length, so estimate the saving by characters
+        run_chars = sum(len(text) for text in to_run)
+        copy_chars = sum(len(text) * (counts[text] - 1) for text in to_run)
+        print("annotated: ", len(to_run), " texts in ", round(elapsed, 2), "s, est. time saved by dedup: ",
+              round(elapsed * copy_chars / max(run_chars, 1), 2), "s")
+    for text in texts:
+        yield results[text]
+
+
+def run_pipeline(texts, workers=1, batch_size=1000):
+    '''
+    Runs texts through the shared pipeline, in this process or across worker processes.
+    Inputs:
+        texts (list): the texts to annotate
+        workers (int): the number of processes to use
+        batch_size (int): the number of texts per batch
+    Returns:
+        a generator of docs, in the order of the texts
+    '''
+    nlp = get_nlp()
+    if workers <= 1:
+        yield from nlp.pipe(texts, batch_size=batch_size)
+        return
+    batches = (texts[i:i + batch_size] for i in range(0, len(texts), batch_size))
+    with ProcessPoolExecutor(max_workers=workers, initializer=shared_nlp, initargs=(PROFILE,)) as executor:
+        for doc_bytes in executor.map(annotate_batch, batches, repeat(PROFILE)):
+            yield from DocBin(DOC_ATTRS, store_user_data=True).from_bytes(doc_bytes).get_docs(nlp.vocab)
+
+
+def doc_to_bytes(doc):
+    '''
+    Serializes a doc with its custom extension attributes.
+    Inputs:
+        doc: an nlp doc object
+    Returns:
+        the serialized DocBin holding the doc
+    '''
+    doc_bin = DocBin(DOC_ATTRS, store_user_data=True)
+    doc_bin.add(doc)
+
+    return doc_bin.to_bytes()
+
+
+def doc_from_bytes(data, vocab):
+    '''
+    Restores a doc serialized by doc_to_bytes.
+    Inputs:
+        data (bytes): the serialized DocBin
+        vocab: the vocab of the shared pipeline
+    Returns:
+        an nlp doc object
+    '''
+    return next(DocBin(DOC_ATTRS, store_user_data=True).from_bytes(data).get_docs(vocab))
+
+
+@lru_cache(maxsize=None)
+def pipeline_fingerprint(profile):
+    '''
+    Fingerprints the shared pipeline: the spaCy and model versions, the
+    components in order, the entity ruler patterns and the source of the
+    custom components. Cached docs are only reused by an identical pipeline.
+    Inputs:
+        profile (str): the pipeline profile
+    Returns:
+        a hex string
+    '''
+    nlp = shared_nlp(profile)
+    parts = [spacy.__version__, MODEL, nlp.meta.get('version'), DOC_ATTRS, inspect.getsource(is_solitarious),
+             inspect.getsource(contains_sol_word)]
+    for name, component in nlp.pipeline:
+        if isinstance(component, EntityRuler):
+            detail = component.patterns
+        elif inspect.isfunction(component):
+            detail = inspect.getsource(component)
+        else:
+            detail = getattr(component, 'cfg', None) or getattr(component, 'punct_chars', None)
+        parts.append([name, type(component).__name__, detail])
+
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def annotate_batch(texts, profile):
+    '''
+    Annotates a batch of texts in a worker process.
+    Inputs:
+        texts (list): the texts to annotate
+        profile (str): the pipeline profile of the parent process
+    Returns:
+        the serialized DocBin of the docs
+    '''
+    doc_bin = DocBin(DOC_ATTRS, store_user_data=True)
+    for doc in shared_nlp(profile).pipe(texts, batch_size=len(texts)):
+        doc_bin.add(doc)
+
+    return doc_bin.to_bytes()
+
+
 def prelim_cleaning(df):
     '''
     Some preliminary cleaning of the dataframe to extract information.
@@ -128,62 +480,47 @@ def make_date_col(month, year):
     '''
     return str(month)+'_'+str(year)
 
-def subject_decline(doc):
+def entity_attributes(doc):
     '''
-    Indicates whether a locust group is predicted to decrease.
+    Marks the custom attributes in one walk of the entities: is_solitarious on
+    LOC_TYPE tokens, subject_decline (whether a locust group or behavior is
+    predicted to decrease) on all entities, and contains_adults and
+    ent_solitarious on LOC_TYPE entities.
     Inputs:
         doc: an nlp doc object
     Returns:
-        the doc with entities having subject_decline attribute marked
+        the doc with the attributes marked
     '''
-    for i, ent in enumerate(doc.ents):
-        if ent.label_ in ('ACTION', 'LOC_TYPE') and i < len(doc.ents) - 1:
-            if doc.ents[i + 1].root.lemma_ == 'decline' or doc.ents[i + 1].root.lemma_ == 'decrease':
+    ents = doc.ents # each access makes new spans
+    for i, ent in enumerate(ents):
+        if ent.label_ in ('ACTION', 'LOC_TYPE') and i < len(ents) - 1:
+            if ents[i + 1].root.lemma_ in ('decline', 'decrease'):
                 ent._.subject_decline = True
-    return doc               
-
-def is_solitarious(doc):
-    '''
-    A token attribute. Indicates whether token references solitarious locusts.
-    Inputs:
-        doc: an nlp doc object
-    Returns:
-        doc with tokens having is_solitarious attribute marked
-    '''
+        solitarious = False
+        if ent.label_ == 'LOC_TYPE':
+            for token in ent:
+                token._.is_solitarious = is_solitarious(token)
+                solitarious = solitarious or token._.is_solitarious
+            ent._.contains_adults = 'adult' in ent.text
+        ent._.ent_solitarious = solitarious
 
-    for token in doc:
-        if token.ent_type_ == 'LOC_TYPE':
-            if contains_sol_word(token):
-                token._.is_solitarious = True
-                continue
-            for child in token.children:
-                if contains_sol_word(child):
-                    token._.is_solitarious = True
-                    continue
-            for conj in token.conjuncts:
-                for child in conj.children:
-                    if contains_sol_word(child):
-                        token._.is_solitarious = True
-            if not token._.is_solitarious:
-                token._.is_solitarious = False
     return doc
 
 
-def ent_solitarious(doc):
+def is_solitarious(token):
     '''
-    Indicates whether an entity contains solitarious locusts.
+    Determines whether a locust token references solitarious locusts, through
+    its own text, its children or the children of its conjuncts.
     Inputs:
-        doc: an nlp doc object
+        token: an nlp token
     Returns:
-        doc with entities having is_solitarious attribute marked
+        boolean of whether the token references solitarious locusts
     '''
-    for ent in doc.ents:
-        for token in ent:
-            if token._.is_solitarious:
-                ent._.ent_solitarious = True
-        ent._.ent_solitarious = False
+    if contains_sol_word(token) or any(contains_sol_word(child) for child in token.children):
+        return True
+
+    return any(contains_sol_word(child) for conj in token.conjuncts for child in conj.children)
 
-    return doc
 
 def contains_sol_word(token):
     '''
@@ -195,20 +532,6 @@ def contains_sol_word(token):
     '''
     return bool(set(['isolated', 'scattered', 'solitarious', 'groups', 'few']).intersection(str.lower(token.text).split()))
 
-def contains_adults(doc):
-    '''
-    Extension that determines whether a LOC_TYPE entity refers to adults
-    Inputs:
-        doc: an nlp doc object
-    Returns:
-        doc with entities having contains_adults attribute marked
-    '''
-    for ent in doc.ents:
-        if ent.label_ == 'LOC_TYPE':
-            ent._.contains_adults = 'adult' in ent.text
-
-    return doc
-
 
 def refine_entities(doc):
     '''
@@ -265,6 +588,33 @@ def refine_entities(doc):
     doc.ents = doc_ents # rewrite entities
     return doc
 
+def load_ruler(nlp, patterns, **cfg):
+    '''
+    Makes an EntityRuler from the pattern file saved for this pattern set in
+    RULER_DIR. A new or changed pattern set is validated once and then saved,
+    so pipelines built later (e.g. in worker processes) skip validation.
+    Inputs:
+        nlp: an nlp object
+        patterns (list): the ruler patterns
+        cfg: the EntityRuler settings
+    Returns:
+        a spaCy EntityRuler object
+    '''
+    key = hashlib.sha256(json.dumps([spacy.__version__, patterns, cfg], sort_keys=True).encode('utf-8')).hexdigest()
+    path = os.path.join(RULER_DIR, key[:16] + '.jsonl')
+    if os.path.exists(path):
+        return EntityRuler(nlp, **cfg).from_disk(path)
+    ruler = EntityRuler(nlp, validate=True, **cfg)
+    ruler.add_patterns(patterns)
+    os.makedirs(RULER_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=RULER_DIR)
+    with os.fdopen(fd, 'w') as f:
+        f.writelines(json.dumps(pattern) + '\n' for pattern in patterns) # in order, unlike ruler.to_disk
+    os.replace(tmp_path, path)
+
+    return ruler
+
+
 def combine_entities_ruler(nlp):
     '''
     Looks for patterns of multiple entites (i.e., LOC near LOC) and combines into single entity.
@@ -274,7 +624,6 @@ def combine_entities_ruler(nlp):
         combine_ruler: a spaCy EntityRuler object
     '''
     patterns = []
-    combine_ruler = EntityRuler(nlp, validate=True, overwrite_ents=True)
     place_near_place = [{'LOWER': {'IN': DIRECTIONS}, 'OP': '?'},
                         {'LOWER': 'of', 'OP': '?'},
                         {'LOWER': 'the', 'OP': '?'},
@@ -294,7 +643,7 @@ def combine_entities_ruler(nlp):
     isolated_scattered = [{'LOWER': {'IN': ['isolated', 'scattered']}, 'OP': '?'},
                          {'ENT_TYPE': 'LOC_TYPE', 'OP': '+'}]
     patterns.append({'label': 'LOC_TYPE', 'pattern': isolated_scattered})
-    combine_ruler.add_patterns(patterns)
+    combine_ruler = load_ruler(nlp, patterns, overwrite_ents=True)
     combine_ruler.name = 'combine_ruler'
 
     return combine_ruler
@@ -309,7 +658,6 @@ def make_entity_ruler(nlp):
     Returns:
         ruler: a spaCy EntityRuler object
     '''
-    ruler = EntityRuler(nlp, validate=True, overwrite=True)
     patterns = []
     patterns.append({'label': 'LOC_TYPE', 'pattern': [{'LOWER': 'no'}, {'LOWER': 'desert', 'OP': '?'}, {'LEMMA': {'IN': ['Locusts', 'locust', 'swarm']}}]})
     patterns.append({'label': 'LOC_TYPE', 'pattern':[{'POS': 'ADJ', 'OP': '?'},
@@ -381,6 +729,6 @@ def make_entity_ruler(nlp):
             [{'LOWER': 'unlikely'}]]
     for pattern in risk:
         patterns.append({'label': 'RISK', 'pattern': pattern})
-    ruler.add_patterns(patterns)
+    ruler = load_ruler(nlp, patterns, overwrite=True)
 
     return ruler
\ No newline at end of file
@@ -1,16 +1,37 @@
 import pdfplumber
 import re
+from get_text import split_chars
 
 def clean_page(file_path, pg_num):
+    return clean_pages(file_path, [pg_num])[0]
+
+
+def clean_pages(file_path, pg_nums=None):
+    '''
+    Opens the PDF once and returns (left, right) text for each requested page.
+    '''
+    rv = []
     with pdfplumber.open(file_path) as pdf:
-        page = pdf.pages[pg_num]
-    left, right = get_left_side(page), get_right_side(page)
-    #right = get_right_side(page)
-    for side in [left, right]:
-        side = single_word(side)
-        side = two_word(side)
-        side = many_countries(side)
-    return (left, right)
+        if pg_nums is None:
+            pg_nums = range(len(pdf.pages))
+        for pg_num in pg_nums:
+            page = pdf.pages[pg_num]
+            left, right = get_columns(page)
+            for side in [left, right]:
+                side = single_word(side)
+                side = two_word(side)
+                side = many_countries(side)
+            rv.append((left, right))
+    return rv
+
+
+def get_columns(page):
+    '''
+    Returns (left, right) column text from a single pass over the page characters.
+    '''
+    bottom = page.height - 80
+    left, right = split_chars(page.chars, page.width // 2, page.width // 2, page.width, bottom)
+    return pdfplumber.utils.extract_text(left), pdfplumber.utils.extract_text(right)
 
 
 def get_left_side(page):
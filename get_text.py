@@ -1,61 +1,261 @@
 import pdfplumber
+import page_cache
+import hashlib
+import json
 import re
+from collections import Counter
+from contextlib import ExitStack
+from itertools import groupby
 
-def clean_page(file_path):
+FOOTER_MARGIN = 70 # footer height cut from the bottom of every page by column_bounds
+CROP_VERSION = 1 # bump whenever the column split code changes, to invalidate page_cache
+SECTION_PATTERN = re.compile(r'(?:\nSituation and Forecast)+(.+?)(?:Announcements?|Other Locusts\n|Glossary of Terms|Other Species|Other Migratory Pests)',
+                             flags = re.DOTALL|re.IGNORECASE)
+TWO_WORD_PATTERN = re.compile(r'[A-Z]  [A-Z]$')
+MANY_COUNTRIES_PATTERN = re.compile(r'[A-Z](.[A-Z]. [A-Z])? ( [A-Z]|  .[A-Z] )? ?,|[A-Z]    [A-Z]')
+SECTION_MARKER = 'situationandforecast' # section heading with spaces removed, for the raw page check
+
+def clean_page(file_path, columns_text=None):
     '''
     Given a file path, returns relevant text.
     NOTE: Only works for AUG 1996 onward.
     Inputs:
         file_path: a string representing the relevant file path
+        columns_text (str): text already extracted from this file by
+            extract_section (defaults to None, which extracts it)
     Returns:
         text from file with some preliminary cleaning done
     '''
-    pdf = pdfplumber.open(file_path)
-    final_txt = []
     year = int(file_path[-4:])
     month = re.findall(r'.+\\([A-Z]+)_', file_path)[0]
-    old_style = (1996 <= year <= 2017)
-    for i, page in enumerate(pdf.pages):
-        left, right = get_left_side(page, i, old_style, file_path), get_right_side(page, i, old_style, file_path)
-        if left:
-            clean_left = clean_text(left)
-        if right:
-            clean_right = clean_text(right)
-        else: # empty right side
-            clean_right = ""
-        final_txt.append(clean_left)
-        final_txt.append(clean_right)
-    final_txt = "\n".join(final_txt)
-    final_txt = get_relevant_text(final_txt, year, month)
+    if columns_text is None:
+        columns_text = extract_section(file_path)
+    final_txt = get_relevant_text(columns_text, year, month)
 
     return final_txt
 
 
-def get_left_side(page, pg_num, old_style, file_path):
+def extract_columns(file_path, use_cache=True):
     '''
-    Formats the left side of the page and returns text.
+    Extracts and joins the cleaned left and right column text of every page.
+    Inputs:
+        file_path: a string representing the relevant file path
+        use_cache (bool): whether to read and write raw column text in page_cache
+    Returns:
+        the column text of the whole file, before the relevant section is pulled out
+    '''
+    return "\n".join(text for pg_num, n_pages, text in iter_page_text(file_path, use_cache=use_cache))
+
+
+def extract_section(file_path, use_cache=True, digest=None):
+    '''
+    Extracts column text only as far as it is needed for the Situation and Forecast section.
+    Pages before the section heading are not laid out, and pages after the
+    closing marker are never read. get_relevant_text gives the same result
+    on this text as on the text of the whole file.
+    Inputs:
+        file_path: a string representing the relevant file path
+        use_cache (bool): whether to read and write raw column text in page_cache
+        digest (str): the file's file_digest, if already known
+    Returns:
+        the column text from the page where the section starts to the page where it ends
+    '''
+    page_texts = []
+    first_page = None
+    n_pages = 0
+    section = ""
+    pages = iter_page_text(file_path, skip_before_section=True, use_cache=use_cache, digest=digest)
+    for pg_num, n_pages, text in pages:
+        if first_page is None:
+            first_page = pg_num
+        page_texts.append(text)
+        section = ("\n" if first_page else "") + "\n".join(page_texts) # keep the newline joining the skipped page
+        if SECTION_PATTERN.search(section):
+            break
+    pages.close()
+    skipped = n_pages if first_page is None else first_page
+    unread = n_pages - skipped - len(page_texts)
+    print("skipped ", skipped, " pages before and ", unread, " pages after the section: ", file_path)
+
+    return section
+
+
+def iter_page_text(file_path, skip_before_section=False, use_cache=True, digest=None):
+    '''
+    Yields the cleaned left and right column text of each page in turn.
+    Raw column text is cached in page_cache by file hash and crop geometry,
+    and the PDF is only opened if a page isn't cached.
+    Inputs:
+        file_path: a string representing the relevant file path
+        skip_before_section (bool): whether to skip pages until one contains
+            the Situation and Forecast heading
+        use_cache (bool): whether to read and write raw column text in page_cache
+        digest (str): the file's file_digest, if already known
+    Yields:
+        tuples of the page number, the number of pages, and the page's column text
+    '''
+    year = int(file_path[-4:])
+    old_style = (1996 <= year <= 2017)
+    if digest is None and use_cache:
+        digest = file_digest(file_path)
+    geometry = geometry_key(file_path)
+    record = page_cache.load(digest, geometry) if use_cache else {'n_pages': None, 'pages': {}}
+    changed = False
+    pdf = None
+    with ExitStack() as stack: # closes the PDF, if it gets opened, however the generator ends
+        try:
+            if record['n_pages'] is None:
+                pdf = stack.enter_context(pdfplumber.open(file_path))
+                record['n_pages'] = len(pdf.pages)
+                changed = True
+            in_section = not skip_before_section
+            for i in range(record['n_pages']):
+                cached = record['pages'].setdefault(str(i), {})
+                if not in_section:
+                    if 'has_marker' not in cached:
+                        pdf = pdf or stack.enter_context(pdfplumber.open(file_path))
+                        raw_text = re.sub(r'\s', '', ''.join(char['text'] for char in pdf.pages[i].chars)).lower()
+                        cached['has_marker'] = SECTION_MARKER in raw_text
+                        changed = True
+                    if not cached['has_marker']:
+                        continue
+                    in_section = True
+                if 'left' not in cached:
+                    pdf = pdf or stack.enter_context(pdfplumber.open(file_path))
+                    cached['left'], cached['right'] = get_columns(pdf.pages[i], i, old_style, file_path)
+                    changed = True
+                left, right = cached['left'], cached['right']
+                clean_left = clean_text(left) if left else ""
+                clean_right = clean_text(right) if right else "" # empty right side
+                yield i, record['n_pages'], clean_left + "\n" + clean_right
+        finally:
+            if use_cache and changed:
+                page_cache.save(digest, geometry, record)
+
+
+def geometry_key(file_path):
+    '''
+    Fingerprints everything that decides where a file's pages are cropped
+    and how their text is extracted, including the pdfplumber version, so
+    cached column text is invalidated when any of it changes.
+    Inputs:
+        file_path: a string representing the relevant file path
+    Returns:
+        a short hex string
+    '''
+    year = int(file_path[-4:])
+    params = [CROP_VERSION, 1996 <= year <= 2017, file_path.endswith('SEPT_2006'), FOOTER_MARGIN,
+              pdfplumber.__version__]
+
+    return hashlib.sha256(json.dumps(params).encode()).hexdigest()[:16]
+
+
+def file_digest(file_path):
+    '''
+    Hashes the bytes of a file so identical bulletins can be recognised.
+    Inputs:
+        file_path: a string representing the relevant file path
+    Returns:
+        the sha256 hex digest of the file
+    '''
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def get_columns(page, pg_num, old_style, file_path):
+    '''
+    Returns the text of both columns of the page from a single pass over its characters.
+    Gives the same text as get_left_side and get_right_side without
+    cropping and laying out the page twice.
     Inputs:
         page: a pdfplumber page object
         pg_num (int): the page number
         old_style: boolean indicating whether follows old (pre-2017 formatting)
         file_path (str): the file path
     Returns:
-        text from left side of page
+        a tuple of the text from the left and right sides of the page
+    '''
+    left_x1, right_x0, bottom = column_bounds(page, pg_num, old_style, file_path)
+    left, right = split_chars(page.chars, left_x1, right_x0, page.width, bottom)
+
+    return pdfplumber.utils.extract_text(left), pdfplumber.utils.extract_text(right)
+
+
+def split_chars(chars, left_x1, right_x0, width, bottom):
+    '''
+    Splits page characters into left and right columns by x-coordinate.
+    Follows page.crop: a character belongs to a column if it overlaps it,
+    and is clipped to the column edge.
+    Inputs:
+        chars: a list of pdfplumber character dictionaries
+        left_x1 (float): the right edge of the left column
+        right_x0 (float): the left edge of the right column
+        width (float): the width of the page
+        bottom (float): the bottom of the text area (excludes the footer)
+    Returns:
+        a tuple of lists of characters in the left and right columns
+    '''
+    left = []
+    right = []
+    for char in chars:
+        if char['top'] >= bottom or char['bottom'] <= 0:
+            continue
+        if char['x0'] < left_x1 and char['x1'] > 0:
+            left.append(char if char['x1'] <= left_x1 else dict(char, x1=left_x1))
+        if char['x1'] > right_x0 and char['x0'] < width:
+            right.append(char if char['x0'] >= right_x0 else dict(char, x0=right_x0))
+
+    return left, right
+
+
+def column_bounds(page, pg_num, old_style, file_path):
     '''
-    x0 = 0
-    if old_style: 
+    Gives the column edges and text bottom for a page.
+    Inputs:
+        page: a pdfplumber page object
+        pg_num (int): the page number
+        old_style: boolean indicating whether follows old (pre-2017 formatting)
+        file_path (str): the file path
+    Returns:
+        a tuple of the right edge of the left column, the left edge of
+        the right column, and the bottom of the text area
+    '''
+    if old_style:
         if pg_num % 2 == 0:
-            x1 = page.width // 2 - 20  
+            left_x1 = page.width // 2 - 20
+            right_x0 = page.width // 2 - 18
         elif file_path.endswith('SEPT_2006') and pg_num == 3:
-            x1 = page.width // 2 + 10
+            left_x1 = page.width // 2 + 10
+            right_x0 = page.width // 2 + 10
         else:
-            x1 = page.width // 2 + 20
+            left_x1 = page.width // 2 + 20
+            right_x0 = page.width // 2 + 20
     else:
-        x1 = page.width // 2
-    bottom = page.height - 70
-    top = 0
+        left_x1 = page.width // 2
+        right_x0 = page.width // 2
+    bottom = page.height - FOOTER_MARGIN
 
-    return page.crop((x0, top, x1, bottom)).extract_text()
+    return left_x1, right_x0, bottom
+
+
+def get_left_side(page, pg_num, old_style, file_path):
+    '''
+    Formats the left side of the page and returns text.
+    Inputs:
+        page: a pdfplumber page object
+        pg_num (int): the page number
+        old_style: boolean indicating whether follows old (pre-2017 formatting)
+        file_path (str): the file path
+    Returns:
+        text from left side of page
+    '''
+    x1, _, bottom = column_bounds(page, pg_num, old_style, file_path)
+
+    return page.crop((0, 0, x1, bottom)).extract_text()
 
 
 def get_right_side(page, pg_num, old_style, file_path):
@@ -69,20 +269,9 @@ def get_right_side(page, pg_num, old_style, file_path):
     Returns:
         text from right side of page
     '''
-    if old_style:
-        if pg_num % 2 == 0:
-            x0 = page.width // 2 - 18
-        elif file_path.endswith('SEPT_2006') and pg_num == 3:
-            x0 = page.width // 2 + 10
-        else:
-            x0 = page.width // 2 + 20
-    else:
-        x0 = page.width // 2
-    x1 = page.width
-    bottom = page.height - 70
-    top = 0
+    _, x0, bottom = column_bounds(page, pg_num, old_style, file_path)
 
-    return page.crop((x0, top, x1, bottom)).extract_text()
+    return page.crop((x0, 0, page.width, bottom)).extract_text()
 
 def single_word(text):
     '''
@@ -93,73 +282,85 @@ def single_word(text):
 def two_word(text):
     '''
     Cleans text of countries with two-word names.
+    Works in a single pass over the lines, so long pages stay linear.
     Inputs:
         text (str): text from PDFs
     '''
     line_list = text.split('\n')
-    for i, line in enumerate(line_list):
-        country = []
-        to_replace = []
-        if re.match(r'[A-Z]  [A-Z]$', line):
-            first_line = line
-            first_line_list = line.split("  ")
-            next_line = line_list[i + 1]
-            next_line_list = next_line.split(" ")
-            for n in range(len(first_line_list)):
-                country.append(first_line_list[n] + next_line_list[n])
-            country = " ".join(country)
-            to_replace.append(first_line)
-            to_replace.append(next_line)
-            to_replace = "\n".join(to_replace)
-            text = text.replace(first_line+'\n'+next_line, country)
-        elif line == "D.R. C":
-            next_line = line_list[i + 1]
-            country = "DR CONGO"
-            text = text.replace(line+'\n'+next_line, country)
-
-    return text
+    rv = []
+    i = 0
+    while i < len(line_list):
+        line = line_list[i]
+        if i + 1 < len(line_list) and TWO_WORD_PATTERN.match(line):
+            next_line_list = line_list[i + 1].split(" ")
+            country = [first + next_line_list[n] for n, first in enumerate(line.split("  "))]
+            rv.append(" ".join(country))
+            i += 2
+        elif i + 1 < len(line_list) and line == "D.R. C":
+            rv.append("DR CONGO")
+            i += 2
+        else:
+            rv.append(line)
+            i += 1
+
+    return '\n'.join(rv)
 
 def many_countries(text):
     '''
     Cleans names of lists of countries.
+    Works in a single pass over the lines, so long pages stay linear.
     Inputs:
         text (str): text from PDF
     Returns:
         text with country name lists cleaned up
     '''
     line_list = text.split('\n')
-    to_replace = []
-    for i, line in enumerate(line_list):
-        to_replace = []
-        rv = ""
-        if re.match(r'[A-Z](.[A-Z]. [A-Z])? ( [A-Z]|  .[A-Z] )? ?,|[A-Z]    [A-Z]', line):
-            to_replace.append(line)
-            first_line_list = re.split(" ", line)
-            next_line = line_list[i + 1]
-            to_replace.append(next_line)
-            next_line_list = next_line.split(" ")
-            suffix_cnt = 0
-            for i, char in enumerate(first_line_list):
-                if char == "UAE" or char == "D.R.":
-                    rv += char + " "                
-                elif re.search(r'[A-Z]', char):
+    rv = []
+    i = 0
+    while i < len(line_list):
+        line = line_list[i]
+        if i + 1 < len(line_list) and MANY_COUNTRIES_PATTERN.match(line):
+            rv.append(join_country_list(line, line_list[i + 1]))
+            i += 2
+        else:
+            rv.append(line)
+            i += 1
+
+    return '\n'.join(rv)
+
+
+def join_country_list(line, next_line):
+    '''
+    Joins a line of country name initials with the line holding the rest of each name.
+    Inputs:
+        line (str): the line of initials, e.g. 'A   , C    AND M'
+        next_line (str): the line of name endings
+    Returns:
+        the list of country names on one line
+    '''
+    rv = ""
+    first_line_list = line.split(" ")
+    next_line_list = next_line.split(" ")
+    suffix_cnt = 0
+    for char in first_line_list:
+        if char == "UAE" or char == "D.R.":
+            rv += char + " "
+        elif re.search(r'[A-Z]', char):
+            rv += char + next_line_list[suffix_cnt]
+            suffix_cnt += 1
+        elif not char: # not repeated empty string
+            if not rv.endswith(" ") and not rv.endswith(","): # accounts for inconsistent oxford commas
+                rv += " "
+            else:
+                if suffix_cnt >= len(next_line_list): # repeated empty space, no more suffix
+                    rv += char
+                else:
                     rv += char + next_line_list[suffix_cnt]
                     suffix_cnt += 1
-                elif not char: # not repeated empty string
-                    if not rv.endswith(" ") and not rv.endswith(","): # accounts for inconsistent oxford commas
-                        rv += " "
-                    else:
-                        if suffix_cnt >= len(next_line_list): # repeated empty space, no more suffix
-                            rv += char
-                        else:
-                            rv += char + next_line_list[suffix_cnt]
-                            suffix_cnt += 1
-                else:
-                    rv += char
-        to_replace = '\n'.join(to_replace)
-        text = text.replace(to_replace, rv)
+        else:
+            rv += char
 
-    return text
+    return rv
 
 
 def clean_text(text):
@@ -172,6 +373,49 @@ def clean_text(text):
     '''
     return many_countries(two_word(single_word(text)))
 
+SKIP_LINE_PATTERN = re.compile(r'(Desert Locust )?Situation and Forecast|D E S E R T  L O C U S T  B U L L E T I N|No. \d+|\( ?see also the summary|^\w ?$',
+                               re.IGNORECASE)
+
+# Normalization rules for get_relevant_text, applied in order: (name, pattern, replacement, flags, pass).
+# Rules share a pass number only if they can't overlap or create matches for each other;
+# ' m.' has to run first because it produces most of the misspellings the 'm' fixes repair,
+# and ' md-' gets its own pass because dropping its leading space can remove the word
+# boundary an 'mre' or 'mde' before it needs ('no mre md-June' stays 'no mremid-June').
+NORMALIZATION_RULES = [
+    ('bullet_cid', r'\(cid:127\)', r'• ', 0, 0),
+    ('forecast_header', r'\n( +)?•( +)?F( +)?(\n)?orecaSt\n', r'\n• FORECAST\n', re.IGNORECASE, 1),
+    ('dash_situation_header', r'\n- SITUATION\n', r'\n• SITUATION\n', re.IGNORECASE, 2),
+    ('situation_header', r'\n( +)?•( +)?S( +)?\n?ituation\n', r'\n• SITUATION\n', re.IGNORECASE, 3),
+    ('split_situation_header', r'\n( +)?• S( +)?\n?ituation\n', r'\n• SITUATION\n', re.IGNORECASE, 4),
+    ('dekad', r'dekad', r'decade', 0, 5),
+    ('sq_abbrev', r' sq.', r' sq', 0, 6),
+    ('m_abbrev', r' m.', r' m', 0, 7),
+    ('sh_abbrev', r' Sh.', r' Sh', 0, 8),
+    ('mtur', r' mtur', r' matur', 0, 9),
+    ('md', r' md-', r'mid-', 0, 10),
+    ('mderate', r'mderate', r'moderate', 0, 11),
+    ('mnth', r'\bmnth\b', r' month', 0, 11),
+    ('mre', r'(\b)mre(\b)', r'(\1)more(\2)', 0, 11),
+    ('mde', r'(\b)mde(\b)', r'\1made\2', 0, 11),
+    ('mve', r' (mve)(s?) ', r' move\2', 0, 12),
+    ('split_significant', r'(signifi) +(cant)', r'\1\2', 0, 13),
+    ('split_significant_ligature', r'signiﬁ +cant', r'significant', 0, 13),
+    ('split_no', r'N +o significant', r'No significant', 0, 14),
+]
+
+# Manual fixes for individual bulletins, keyed by (year, month).
+BULLETIN_PATCHES = {
+    (1996, 'AUG'): [('AUG_1996_niger', r'\nNiger\n', r'\nNiger\n• SITUATION\n', 0, 0)],
+    (2007, 'OCT'): [('OCT_2007_coastal_plains', r'\ncoastal plains\n', r'\ncoastal plains.\n', 0, 0)],
+    (1996, 'SEPT'): [('1996_somalia', r'the east\nSomalia\n', r'the east.\nSomalia\n', 0, 0)],
+    (1996, 'OCT'): [('1996_somalia', r'the east\nSomalia\n', r'the east.\nSomalia\n', 0, 0)],
+    (1999, 'JUNE'): [('JUNE_1999_chad', r'commence\nChad\n', r'commence.\nChad\n', 0, 0)],
+    (1999, 'NOV'): [('NOV_1999_niger', r'Morocco\nNiger\n', r'Morocco.\nNiger\n', 0, 0)],
+    (2008, 'JUNE'): [('JUNE_2008_afghanistan', r'summer\nAfghanistan\n', r'summer.\nAfghanistan\n', 0, 0)],
+}
+RULE_COUNTS = Counter()
+
+
 def get_relevant_text(text, year, month):
     '''
     Cleans up relevant text so it can be parsed into a dataframe.
@@ -182,44 +426,86 @@ def get_relevant_text(text, year, month):
     Returns:
         relevant text with some cleaning done
     '''
-    result = re.findall(r'(?:\nSituation and Forecast)+(.+?)(?:Announcements?|Other Locusts\n|Glossary of Terms|Other Species|Other Migratory Pests)', 
-                        text, flags = re.DOTALL|re.IGNORECASE)[0]
+    result = SECTION_PATTERN.findall(text)[0]
     to_keep = []
     for line in result.split('\n'):
-        if line and not re.match(r'(Desert Locust )?Situation and Forecast|D E S E R T  L O C U S T  B U L L E T I N|No. \d+|\( ?see also the summary|^\w ?$', line, re.IGNORECASE):
+        if line and not SKIP_LINE_PATTERN.match(line):
             to_keep.append(line)
     final_text = '\n'.join(to_keep)
-    final_text = re.sub(r'\(cid:127\)', r'• ', final_text)
-    final_text = re.sub(r'\n( +)?•( +)?F( +)?(\n)?orecaSt\n', r'\n• FORECAST\n', final_text, flags = re.IGNORECASE)
-    final_text = re.sub(r'\n- SITUATION\n', r'\n• SITUATION\n', final_text, flags = re.IGNORECASE)
-    final_text = re.sub(r'\n( +)?•( +)?S( +)?\n?ituation\n', r'\n• SITUATION\n', final_text, flags = re.IGNORECASE)
-    final_text = re.sub(r'\n( +)?• S( +)?\n?ituation\n', r'\n• SITUATION\n', final_text, flags = re.IGNORECASE)
-    final_text = re.sub(r'dekad', r'decade', final_text)
-    final_text = re.sub(r' sq.', r' sq', final_text)
-    final_text = re.sub(r' m.', r' m', final_text)
-    final_text = re.sub(r' Sh.', r' Sh', final_text)
-    final_text = re.sub(r' mtur', r' matur', final_text)
-    final_text = re.sub(r' md-', r'mid-', final_text)
-    final_text = re.sub(r'mderate', r'moderate', final_text)
-    final_text = re.sub(r'\bmnth\b', r' month', final_text)
-    final_text = re.sub(r'(\b)mre(\b)', r'(\1)more(\2)', final_text)
-    final_text = re.sub(r'(\b)mde(\b)', r'\1made\2', final_text)
-    final_text = re.sub(r' (mve)(s?) ', r' move\2', final_text)
-    final_text = re.sub(r'(signifi) +(cant)', r'\1\2', final_text)
-    final_text = re.sub(r'signiﬁ +cant', r'significant', final_text)
-    final_text = re.sub(r'N +o significant', r'No significant', final_text)
-    if year == 1996 and month == 'AUG':
-        final_text = re.sub(r'\nNiger\n', r'\nNiger\n• SITUATION\n', final_text) # manually fix AUG 1996 issue
-    if year == 2007 and month == 'OCT':
-        final_text = re.sub(r'\ncoastal plains\n', r'\ncoastal plains.\n', final_text) # manually fix OCT 2007 issue
-    if year == 1996 and month in ['SEPT', 'OCT']:
-        final_text = re.sub(r'the east\nSomalia\n', r'the east.\nSomalia\n', final_text)
-    if year == 1999 and month == 'JUNE':
-        final_text = re.sub(r'commence\nChad\n', r'commence.\nChad\n', final_text)
-    if year == 1999 and month == 'NOV':
-        final_text = re.sub(r'Morocco\nNiger\n', r'Morocco.\nNiger\n', final_text)
-    if year == 2008 and month == 'JUNE':
-        final_text = re.sub(r'summer\nAfghanistan\n', r'summer.\nAfghanistan\n', final_text)
+    for rule_pass in NORMALIZATION_PASSES:
+        final_text = apply_pass(rule_pass, final_text)
+    for rule_pass in BULLETIN_PATCH_PASSES.get((year, month), []):
+        final_text = apply_pass(rule_pass, final_text)
 
     return final_text
 
+
+def compile_rules(rules):
+    '''
+    Compiles a rule table into passes over the text. Consecutive rules with
+    the same pass number are joined into one alternation and applied in a single scan.
+    Inputs:
+        rules: a list of (name, pattern, replacement, flags, pass number) tuples
+    Returns:
+        a list of passes, each a tuple of the combined pattern and a dictionary
+        of group names to (rule name, compiled rule, replacement)
+    '''
+    passes = []
+    for pass_num, pass_rules in groupby(rules, key=lambda rule: rule[4]):
+        alternatives = []
+        by_group = {}
+        for i, (name, pattern, replacement, flags, _) in enumerate(pass_rules):
+            group = 'r' + str(i)
+            if flags & re.IGNORECASE:
+                pattern = '(?i:' + pattern + ')'
+            alternatives.append('(?P<' + group + '>' + pattern + ')')
+            by_group[group] = (name, re.compile(pattern, flags), replacement)
+        passes.append((re.compile('|'.join(alternatives)), by_group))
+
+    return passes
+
+
+def apply_pass(rule_pass, text):
+    '''
+    Applies one pass of normalization rules to text and counts how often each rule fires.
+    Inputs:
+        rule_pass: a pass as made by compile_rules
+        text (str): the text to normalize
+    Returns:
+        the normalized text
+    '''
+    combined, by_group = rule_pass
+    if len(by_group) == 1:
+        name, compiled, replacement = by_group['r0']
+        text, count = compiled.subn(replacement, text)
+        RULE_COUNTS[name] += count
+        return text
+
+    def replace(match):
+        name, compiled, replacement = by_group[match.lastgroup]
+        RULE_COUNTS[name] += 1
+        return compiled.fullmatch(match.group(match.lastgroup)).expand(replacement)
+
+    return combined.sub(replace, text)
+
+
+def rule_counts():
+    '''
+    Reports how many times each normalization rule has fired since the last reset.
+    Returns:
+        a list of (rule name, count) tuples, most frequent first
+    '''
+    return RULE_COUNTS.most_common()
+
+
+def reset_rule_counts():
+    '''
+    Resets the normalization rule counts.
+    '''
+    RULE_COUNTS.clear()
+
+    return None
+
+
+NORMALIZATION_PASSES = compile_rules(NORMALIZATION_RULES)
+BULLETIN_PATCH_PASSES = {bulletin: compile_rules(rules) for bulletin, rules in BULLETIN_PATCHES.items()}
@@ -9,6 +9,7 @@ from dateutil.relativedelta import relativedelta
 from treelib import Node, Tree
 from fuzzywuzzy import fuzz
 from dateutil import rrule
+from extract_info import CompactDoc
 
 
 MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUNE', 'JULY', 'AUG', 'SEPT', 'OCT', 'NOV', 'DEC']
@@ -92,11 +93,11 @@ def get_locations(doc):
     '''
     Gets mentions of locations from nlp object.
     Inputs:
-        doc: a spaCy nlp doc object
+        doc: a spaCy nlp doc object, or a CompactDoc of its features
     returns:
         a list of locations (strings)
     '''
-    if type(doc) != spacy.tokens.doc.Doc:
+    if not isinstance(doc, (spacy.tokens.doc.Doc, CompactDoc)):
         return []
     locations = [ent.text for ent in doc.ents if ent.label_ in ['SPEC_LOC', 'GEN_LOC']]
 
@@ -1,54 +1,340 @@
 '''
 Takes in a string of text and makes a pandas dataframe
 '''
-from get_text import clean_page
+from get_text import clean_page, extract_section, file_digest, geometry_key
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import argparse
+import shutil
 import re
 import os
 
-if __name__=='__main__':
-    make_csv()
+ROOT_DIR = '../../dataRAW/FAO_Reports'
+CSV_PATH = '../../dataCSV/FAO_Reports/report_text.csv'
+PARQUET_PATH = '../../dataCSV/FAO_Reports/report_text.parquet'
+COLUMNS = ['YEAR', 'MONTH', 'COUNTRY', 'SITUATION', 'FORECAST', 'REGION']
+SITUATION_LINE = re.compile(r'(?:  )?• SITUATION ? ?', re.IGNORECASE)
+FORECAST_LINE = re.compile(r'(?: +)?• FORECAST ?', re.IGNORECASE)
+FORECAST_PREFIX = re.compile(r'(?: +)?• FORECAST', re.IGNORECASE)
+REGIONS = ["WESTERN REGION", "WEST AFRICA", 'NORTH-WEST AFRICA', 'EASTERN AFRICA', 
+    'NEAR EAST', 'SOUTH-WEST ASIA', "CENTRAL REGION", "EASTERN REGION", 'MEDITERRANEAN', 'EUROPE']
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUNE', 'JULY', 'AUG', 'SEPT', 'OCT', 'NOV', 'DEC']
+
+
+def make_csv(root_dir=ROOT_DIR, csv_path=CSV_PATH, workers=1, parquet_path=PARQUET_PATH):
+    '''
+    Goes through all files, makes a pandas dataframe per file, combines them, exports as csv.
+    Files are always parsed in year/month order, so the csv is the same
+    whatever the number of workers. Each file is hashed once, up front.
+    Inputs:
+        root_dir (str): the directory containing the year directories
+        csv_path (str): where to write the csv
+        workers (int): the number of processes used for PDF text extraction
+        parquet_path (str): where to also write the typed Parquet dataset
+            (None to skip it)
+    '''
+    frames = []
+    extracted = {}
+    file_paths = get_file_paths(root_dir)
+    digests = {file_path: file_digest(file_path) for file_path in file_paths}
+    if workers > 1:
+        extracted = extract_parallel(file_paths, workers, digests)
+    for file_path in file_paths:
+        frames.append(parse_text(file_path, extracted, digests[file_path]))
+        print("added to df: ", file_path)
+    df = pd.concat(frames, ignore_index=True) if frames else new_df()
+    df.to_csv(path_or_buf=csv_path)
+    print("csv added")
+    if parquet_path:
+        try:
+            write_parquet(df, parquet_path)
+            print("parquet added")
+        except ImportError as e:
+            print("parquet skipped: ", e)
+    return df
+
+
+def ingest(file_paths, csv_path=CSV_PATH, parquet_path=PARQUET_PATH):
+    '''
+    Parses only the given bulletins and upserts their rows into the csv,
+    keyed by (YEAR, MONTH, COUNTRY): existing rows with a key in the new rows
+    are replaced, so ingesting the same bulletin twice changes nothing.
+    Inputs:
+        file_paths (list): paths of the new bulletins, each ending in MONTH_YEAR
+        csv_path (str): the csv to update (created if missing)
+        parquet_path (str): the Parquet dataset to rewrite from the updated csv
+            (None to skip it)
+    Returns:
+        the updated dataframe
+    '''
+    for file_path in file_paths:
+        if not re.search(r'[A-Z_]+_\d{4}$', file_path):
+            raise ValueError("bulletin paths must end in MONTH_YEAR: " + file_path)
+    new_rows = pd.concat([parse_text(file_path) for file_path in sorted(file_paths, key=bulletin_order)],
+                         ignore_index=True) if file_paths else new_df()
+    if os.path.exists(csv_path):
+        df = pd.read_csv(csv_path, index_col=0)
+    else:
+        df = new_df()
+    key = ['YEAR', 'MONTH', 'COUNTRY']
+    replaced = pd.MultiIndex.from_frame(df[key]).isin(pd.MultiIndex.from_frame(new_rows[key]))
+    df = pd.concat([df[~replaced], new_rows], ignore_index=True)
+    month_nums = df['MONTH'].map(month_number).fillna(len(MONTHS) + 1)
+    df = (df.assign(MONTH_NUM=month_nums).sort_values(['YEAR', 'MONTH_NUM'], kind='stable')
+            .drop(columns='MONTH_NUM').reset_index(drop=True))
+    df.to_csv(path_or_buf=csv_path)
+    print("ingested ", len(new_rows), " rows, replacing ", replaced.sum(), " rows")
+    if parquet_path:
+        try:
+            write_parquet(df, parquet_path)
+            print("parquet added")
+        except ImportError as e:
+            print("parquet skipped: ", e)
+    return df
+
+
+def typed_df(df):
+    '''
+    Gives the bulletin table the column types used for columnar storage:
+    integer YEAR, categorical MONTH, COUNTRY and REGION, a DATE column for the
+    first of the bulletin's month, and a DECADE column to partition on.
+    Rows are sorted by decade, country and date.
+    Inputs:
+        df: a dataframe as made by make_csv
+    Returns:
+        a new, typed dataframe
+    '''
+    df = df[COLUMNS].copy()
+    df['YEAR'] = df['YEAR'].astype('int64')
+    months = [month for month in df['MONTH'].unique() if month not in MONTHS]
+    df['MONTH'] = pd.Categorical(df['MONTH'], categories=MONTHS + sorted(months), ordered=True)
+    df['COUNTRY'] = df['COUNTRY'].astype('category')
+    df['REGION'] = df['REGION'].astype('category')
+    month_nums = df['MONTH'].map(month_number).astype('float64')
+    df['DATE'] = pd.to_datetime(pd.DataFrame({'year': df['YEAR'], 'month': month_nums, 'day': 1}),
+                                errors='coerce')
+    df['DECADE'] = df['YEAR'] // 10 * 10
+    df = df.sort_values(['DECADE', 'COUNTRY', 'DATE'], kind='stable', ignore_index=True)
+
+    return df
+
+
+def month_number(month):
+    '''
+    Gives the calendar month of a bulletin's month label; for bulletins
+    covering two months (e.g. JULY_AUG), the first one.
+    Inputs:
+        month (str): the month label
+    Returns:
+        the month number from 1 to 12, or None if the label isn't a month
+    '''
+    month = str(month).split('_')[0]
+
+    return MONTHS.index(month) + 1 if month in MONTHS else None
+
 
-def make_csv():
+def write_parquet(df, parquet_path=PARQUET_PATH):
     '''
-    Goes through all files, adds data to a pandas dataframe, exports as csv.
+    Writes the bulletin table as a Parquet dataset partitioned by decade,
+    replacing any earlier one. Needs pyarrow.
+    Inputs:
+        df: a dataframe as made by make_csv
+        parquet_path (str): the dataset directory
+    '''
+    import pyarrow # noqa: F401 -- fail before touching the old dataset
+    tmp_path = parquet_path + '.part'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    typed_df(df).to_parquet(tmp_path, engine='pyarrow', partition_cols=['DECADE'], index=False)
+    shutil.rmtree(parquet_path, ignore_errors=True)
+    os.replace(tmp_path, parquet_path)
+
+    return None
+
+
+def read_parquet(parquet_path=PARQUET_PATH, decades=None, countries=None, columns=None):
+    '''
+    Loads the bulletin table, or a slice of it, from the Parquet dataset.
+    Only the decade partitions asked for are read.
+    Inputs:
+        parquet_path (str): the dataset directory
+        decades (list): decades to load, e.g. [2000] (defaults to all)
+        countries (list): countries to load (defaults to all)
+        columns (list): columns to load (defaults to all)
+    Returns:
+        a typed dataframe
+    '''
+    filters = []
+    if decades is not None:
+        filters.append(('DECADE', 'in', [int(decade) for decade in decades]))
+    if countries is not None:
+        filters.append(('COUNTRY', 'in', list(countries)))
+    df = pd.read_parquet(parquet_path, engine='pyarrow', columns=columns, filters=filters or None)
+    df = df.drop(columns='DECADE', errors='ignore')
+    for col in ['COUNTRY', 'REGION']:
+        if col in df.columns:
+            df[col] = df[col].cat.remove_unused_categories()
+
+    return df
+
+
+def get_file_paths(root_dir):
+    '''
+    Lists the bulletins to parse in year/month order.
+    Inputs:
+        root_dir (str): the directory containing the year directories
+    Returns:
+        a list of file paths
     '''
-    root_dir = '../../dataRAW/FAO_Reports'
     ignore_list = ['JAN_1996', 'FEB_1996', 'MAR_1996', 'APR_1996', 'MAY_1996', 'JUNE_1996']
-    df = new_df()
+    file_paths = []
     for subdir, dirs, files in os.walk(root_dir):
-        dirs[:] = [d for d in dirs if int(d) >= 1996]
-        files[:] = [f for f in files if f not in ignore_list]
+        dirs[:] = [d for d in dirs if d.isdigit() and int(d) >= 1996]
+        files[:] = [f for f in files if f not in ignore_list and re.match(r'[A-Z_]+_\d{4}$', f)]
         for f in files:
-            file_path = os.path.join(subdir, f)
-            df = parse_text(file_path, df)
-            print("added to df: ", file_path)
-    df.to_csv(path_or_buf='../../dataCSV/FAO_Reports/report_text.csv')
-    print("csv added")
-    return df
+            file_paths.append(os.path.join(subdir, f))
+
+    return sorted(file_paths, key=bulletin_order)
+
+
+def bulletin_order(file_path):
+    '''
+    Sort key putting bulletins in chronological order.
+    Inputs:
+        file_path (str): the path of the bulletin, ending in MONTH_YEAR
+    Returns:
+        a (year, month number, file path) tuple
+    '''
+    month, year = re.findall(r'([A-Z]+)(?:_[A-Z]+)?_(\d{4})$', file_path)[0]
+    month_num = MONTHS.index(month) if month in MONTHS else len(MONTHS)
+
+    return (int(year), month_num, file_path)
+
+
+def extract_parallel(file_paths, workers, digests=None):
+    '''
+    Extracts the column text of each distinct bulletin across a process pool.
+    Inputs:
+        file_paths (list): the bulletins to extract
+        workers (int): the number of processes to use
+        digests (dict): the file_digest of each file path, if already known
+    Returns:
+        a dictionary of column text keyed by extraction_key, as used by parse_text
+    '''
+    digests = digests or {}
+    to_extract = {}
+    for file_path in file_paths:
+        digest = digests.get(file_path) or file_digest(file_path)
+        to_extract.setdefault(extraction_key(file_path, digest), (file_path, digest))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        texts = executor.map(extract_section, [file_path for file_path, digest in to_extract.values()],
+                             repeat(True), [digest for file_path, digest in to_extract.values()])
+        extracted = dict(zip(to_extract.keys(), texts))
+
+    return extracted
+
+
+def extraction_key(file_path, digest):
+    '''
+    Keys a file's extracted column text on everything it depends on: the
+    file's bytes and the crop geometry used for its path (see get_text.geometry_key).
+    Inputs:
+        file_path (str): the path of the bulletin
+        digest (str): the file_digest of the bulletin
+    Returns:
+        a (digest, geometry key) tuple
+    '''
+    return (digest, geometry_key(file_path))
 
 
 def new_df():
     '''
     Makes a new Pandas dataframe with appropriate columns.
     '''
-    cols = ['YEAR', 'MONTH', 'COUNTRY', 'SITUATION', 'FORECAST']
-    df = pd.DataFrame(columns=cols)
+    return records_to_df(new_records())
+
+
+def new_records():
+    '''
+    Makes an empty columnar record builder: a dictionary of column names to lists.
+    '''
+    return {col: [] for col in COLUMNS}
+
+
+def add_record(records, year, month, region, country, situation, forecast):
+    '''
+    Adds one country's row to a record builder. The situation and forecast
+    are prepared with prep_text here, once, using the row's own year and month.
+    Inputs:
+        records: a record builder from new_records
+        year (int): the year of the report
+        month (str): the month of the report
+        region (str): the region the country is listed under
+        country (str): the country name
+        situation (str): the situation text
+        forecast (str): the forecast text
+    '''
+    records['YEAR'].append(year)
+    records['MONTH'].append(month)
+    records['COUNTRY'].append(country)
+    records['SITUATION'].append(prep_text(year, month, situation))
+    records['FORECAST'].append(prep_text(year, month, forecast))
+    records['REGION'].append(region)
+
+    return None
+
+
+def records_to_df(records):
+    '''
+    Turns a record builder into a Pandas dataframe.
+    Inputs:
+        records: a record builder from new_records
+    Returns:
+        a dataframe with an integer YEAR column and text columns
+    '''
+    df = pd.DataFrame(records, columns=COLUMNS)
+    df['YEAR'] = df['YEAR'].astype('int64')
+
     return df
 
 
-def parse_text(file_path, df):
+def parse_text(file_path, extracted=None, digest=None):
     '''
-    Takes a single file and adds its contents to an existing Pandas dataframe.
+    Takes a single file and makes a Pandas dataframe of its contents.
+    Inputs:
+        file_path (str): the path of the bulletin
+        extracted (dict): column text already extracted, keyed by extraction_key,
+            so duplicate bulletins are only parsed once (defaults to None)
+        digest (str): the file_digest of the bulletin, if already known
     '''
-    rel_text = clean_page(file_path)
-    regions = ["WESTERN REGION", "WEST AFRICA", 'NORTH-WEST AFRICA', 'EASTERN AFRICA', 
-    'NEAR EAST', 'SOUTH-WEST ASIA', "CENTRAL REGION", "EASTERN REGION", 'MEDITERRANEAN', 'EUROPE']
-    countries = get_countries(rel_text)
+    columns_text = None
+    if extracted is not None:
+        digest = digest or file_digest(file_path)
+        key = extraction_key(file_path, digest)
+        if key not in extracted:
+            extracted[key] = extract_section(file_path, digest=digest)
+        columns_text = extracted[key]
+    rel_text = clean_page(file_path, columns_text)
     year = int(file_path[-4:])
     month = re.findall(r'.+/(.+)_\d+', file_path)[0]
-    region = "WESTERN REGION"    
-    for country, situation, forecast in countries:
+    records = new_records()
+    for region, country, situation, forecast in parse_sections(rel_text, file_path):
+        add_record(records, year, month, region, country, situation, forecast)
+
+    return records_to_df(records)
+
+
+def parse_sections(text, file_path=''):
+    '''
+    Splits a bulletin's relevant text into one section per country.
+    Inputs:
+        text (str): the relevant text of the bulletin
+        file_path (str): the path of the bulletin, for warnings
+    Yields:
+        (region, country, situation, forecast) tuples
+    '''
+    region = "WESTERN REGION"
+    for country, situation, forecast in get_countries(text):
         dif_formatting = False
         country_list = re.split(r",? \n?AND|, ?", country.upper())
         if re.match(r'SYRIA\nAND TURKEY', country_list[-1]):
@@ -59,7 +345,7 @@ def parse_text(file_path, df):
             country_list.append('UAE')
         for cty in country_list:
             cty = cty.lstrip()
-            if any(region in cty.upper() for region in regions) and "MEDITERRANEAN SEA" not in cty.upper(): # if the string contains a region
+            if any(region in cty.upper() for region in REGIONS) and "MEDITERRANEAN SEA" not in cty.upper(): # if the string contains a region
                 region_list = cty.split('\n')
                 region = region_list[0]
                 cty = region_list[1]
@@ -71,8 +357,7 @@ def parse_text(file_path, df):
             med_sea_split = re.split(r'\nMEDITERRANEAN SEA\n', forecast) # weird bit with no situation or forecast
             if len(med_sea_split) > 1:
                 forecast = med_sea_split[0]
-                df = df.append({'YEAR': year, 'MONTH': month, 'REGION': 'MEDITERRANEAN SEA', 'COUNTRY': 'MEDITERRANEAN SEA', 
-                        'SITUATION': med_sea_split[1], 'FORECAST': None}, ignore_index=True)
+                yield 'MEDITERRANEAN SEA', 'MEDITERRANEAN SEA', med_sea_split[1], None
             if len(re.split(r'\n•?(?: +)?FORECAST\n', forecast)) > 1: 
                 forecast, to_enter = dif_format_countries(forecast)
                 dif_formatting = True 
@@ -82,25 +367,22 @@ def parse_text(file_path, df):
                     print(file_path)
                     print(item)
                 
-            df = df.append({'YEAR': year, 'MONTH': month, 'REGION': region, 'COUNTRY': cty, 
-                        'SITUATION': situation, 'FORECAST': forecast}, ignore_index=True)
+            yield region, cty, situation, forecast
         if dif_formatting:
             for name, info in to_enter.items():
                 sit = to_enter[name]['SITUATION']
                 fcast = to_enter[name]['FORECAST']
-                if any(region in name.upper() for region in regions) and "MEDITERRANEAN SEA" not in name.upper(): # if the string contains a region
+                if any(region in name.upper() for region in REGIONS) and "MEDITERRANEAN SEA" not in name.upper(): # if the string contains a region
                     name = name.lstrip()
                     region_list = name.split('\n')
                     region = region_list[0].lstrip()
                     name = region_list[1].lstrip()
                 name = re.sub('\n', " ", name)
-                df = df.append({'YEAR': year, 'MONTH': month, 'REGION': region, 'COUNTRY': name, 
-                'SITUATION': sit, 'FORECAST': fcast}, ignore_index=True)
-    df['SITUATION'] = df.apply(lambda x: prep_text(year, month, x.SITUATION), axis=1)
-    df['FORECAST'] = df.apply(lambda x: prep_text(year, month, x.FORECAST), axis=1)
+                yield region, name, sit, fcast
+
+    return None
+
 
-    return df
-        
 def dif_format_countries(og_text):
     '''
     Finds countries that don't have labeled situations or bullets before 'FORECAST'.
@@ -133,17 +415,101 @@ def dif_format_countries(og_text):
 def get_countries(text):
     '''
     Parses country names, situation, and forecast out of text file.
+    Scans the lines once for the SITUATION and FORECAST markers, so it runs in
+    time linear in the length of the text. Each forecast ends at its last full stop
+    before the next marker; what follows is the next country's name. Gives the same
+    result as the regex it replaced (benchmarks.regex_get_countries), including its quirks:
+    a SITUATION line with no text before the FORECAST line is read as part of the
+    country name, and a FORECAST line that ends the text yields no row.
     Inputs:
         text (str): the full text
     Returns:
         countries: a list of tuples of countries, situations, and forecasts
     '''
-    countries = re.findall(r'(.+?)(?:\n(?:  )?• SITUATION ? ?\n(.+?))?\n(?: +)?• FORECAST ?\n(.+?)(?=$|[^.]+(?:\n(?:  )?• SITUATION ? ?\n.+)?• FORECAST)', 
-                            text, re.DOTALL|re.IGNORECASE)
-    countries = re.findall(r'(.+?)(?:\n(?:  )?• SITUATION ? ?\n(.+?))?\n(?: +)?• FORECAST ?\n(.+?)(?=$|[^.]+(?:\n(?:  )?• SITUATION ? ?\n.+)?\n(?: +)?• FORECAST)', 
-                            text, re.DOTALL|re.IGNORECASE)
+    markers, terminators = tokenize_markers(text)
+    countries = []
+    start = 0
+    m = 0
+    t = 0
+    while m < len(markers):
+        while m < len(markers) and markers[m][1] <= start: # country names are at least one character
+            m += 1
+        if m == len(markers):
+            break
+        kind, marker_start, marker_end = markers[m]
+        situation = ''
+        if kind == 'SITUATION':
+            fc = m + 1
+            while fc < len(markers) and (markers[fc][0] != 'FORECAST' or markers[fc][1] < marker_end
+                                         or markers[fc][2] == len(text)):
+                fc += 1
+            if fc == len(markers): # no situation text: the marker line becomes part of the country name
+                m += 1
+                continue
+            situation = text[marker_end:markers[fc][1]]
+            m = fc
+        country = text[start:marker_start]
+        forecast_start = markers[m][2]
+        if forecast_start == len(text): # a forecast marker with nothing after it ends no country
+            break
+        while t < len(terminators) and terminators[t] <= forecast_start + 1:
+            t += 1
+        end = None
+        while t < len(terminators) and end is None:
+            # the next country's name needs at least one character after the full stop
+            end = max(text.rfind('.', forecast_start, terminators[t]) + 1, forecast_start + 1)
+            if end == terminators[t]:
+                end = None
+                t += 1
+        if end is None: # last country: forecast runs to the end, less a final newline
+            end = len(text) - 1 if text.endswith('\n') else len(text)
+            countries.append((country, situation, text[forecast_start:max(end, forecast_start + 1)]))
+            break
+        countries.append((country, situation, text[forecast_start:end]))
+        start = end
+        m += 1
+
     return countries
 
+
+def tokenize_markers(text):
+    '''
+    Finds the SITUATION and FORECAST marker lines of a bulletin in one pass over its lines.
+    Inputs:
+        text (str): the full text
+    Returns:
+        markers: a list of (kind, start, end) tuples, where kind is 'SITUATION'
+            or 'FORECAST', start is the offset of the newline before the marker line,
+            and end is the offset just after the newline that ends it
+        terminators: offsets of the newlines before every line that can end a
+            forecast (a SITUATION marker, or a line starting with a FORECAST marker)
+    '''
+    markers = []
+    forecast_prefixes = []
+    situations = []
+    lines = text.split('\n')
+    offset = 0
+    for i, line in enumerate(lines):
+        line_start = offset
+        offset += len(line) + 1
+        if i == 0:
+            continue
+        if FORECAST_PREFIX.match(line):
+            forecast_prefixes.append(line_start - 1)
+        if i == len(lines) - 1:
+            continue
+        if SITUATION_LINE.fullmatch(line):
+            markers.append(('SITUATION', line_start - 1, offset))
+            situations.append((line_start - 1, offset))
+        elif FORECAST_LINE.fullmatch(line):
+            markers.append(('FORECAST', line_start - 1, offset))
+    # a SITUATION marker only ends a forecast if a FORECAST marker comes after its first line
+    last_forecast = forecast_prefixes[-1] if forecast_prefixes else -1
+    terminators = sorted(forecast_prefixes + [start for start, end in situations if last_forecast > end])
+
+    return markers, terminators
+
+
 def prep_text(year, month, text):
     '''
     Prepares text for processing.
@@ -163,4 +529,21 @@ def prep_text(year, month, text):
     text = re.sub(r'no reports of ([a-z]+)', r'no \1', text)
     text = re.sub(r'(signifi) +(cant)', r'\1\2', text)
 
-    return text
\ No newline at end of file
+    return text
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Parses locust bulletins into report_text.csv.')
+    parser.add_argument('--root-dir', default=ROOT_DIR)
+    parser.add_argument('--csv-path', default=CSV_PATH)
+    parser.add_argument('--parquet-path', default=PARQUET_PATH,
+                        help="where to write the typed Parquet dataset ('' to skip it)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used for PDF text extraction')
+    parser.add_argument('--ingest', nargs='+', metavar='BULLETIN',
+                        help='parse only these bulletins and upsert their rows into the csv')
+    args = parser.parse_args()
+    if args.ingest:
+        ingest(args.ingest, args.csv_path, args.parquet_path)
+    else:
+        make_csv(args.root_dir, args.csv_path, args.workers, args.parquet_path)
@@ -0,0 +1,103 @@
+'''
+On-disk cache of raw per-page column text, so cleaning and parsing can be
+re-run without laying out the PDFs again.
+'''
+import json
+import os
+import tempfile
+
+CACHE_DIR = '.page_cache'
+MAX_CACHE_BYTES = 500 * 1024 * 1024
+
+
+def cache_path(digest, geometry, cache_dir=CACHE_DIR):
+    '''
+    Gives the location of the cache record for a file.
+    Inputs:
+        digest (str): the hash of the PDF
+        geometry (str): a fingerprint of the crop geometry used to extract it
+        cache_dir (str): the cache directory
+    Returns:
+        the path of the record
+    '''
+    return os.path.join(cache_dir, digest + '-' + geometry + '.json')
+
+
+def load(digest, geometry, cache_dir=CACHE_DIR):
+    '''
+    Loads the cache record for a file, marking it as recently used.
+    Inputs:
+        digest (str): the hash of the PDF
+        geometry (str): a fingerprint of the crop geometry used to extract it
+        cache_dir (str): the cache directory
+    Returns:
+        a dictionary with 'n_pages' and 'pages' (page number -> cached values);
+        empty if the file isn't cached
+    '''
+    path = cache_path(digest, geometry, cache_dir)
+    try:
+        with open(path) as f:
+            record = json.load(f)
+        os.utime(path)
+    except (OSError, ValueError):
+        record = {'n_pages': None, 'pages': {}}
+
+    return record
+
+
+def save(digest, geometry, record, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    '''
+    Saves the cache record for a file, then evicts old records if the cache is too big.
+    Inputs:
+        digest (str): the hash of the PDF
+        geometry (str): a fingerprint of the crop geometry used to extract it
+        record: a dictionary as returned by load
+        cache_dir (str): the cache directory
+        max_bytes (int): the largest the cache may grow
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=cache_dir)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(record, f)
+    os.replace(tmp_path, cache_path(digest, geometry, cache_dir))
+    evict(cache_dir, max_bytes)
+
+    return None
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    '''
+    Deletes the least recently used records until the cache fits in max_bytes.
+    Inputs:
+        cache_dir (str): the cache directory
+        max_bytes (int): the largest the cache may grow
+    Returns:
+        the number of records deleted
+    '''
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.json'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for mtime, size, path in entries)
+    deleted = 0
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError: # already removed by another process
+            pass
+        total -= size
+        deleted += 1
+
+    return deleted
+
+
+def clear(cache_dir=CACHE_DIR):
+    '''
+    Deletes every record in the cache.
+    Inputs:
+        cache_dir (str): the cache directory
+    '''
+    return evict(cache_dir, 0) if os.path.isdir(cache_dir) else 0
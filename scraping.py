@@ -1,84 +1,473 @@
 from bs4 import BeautifulSoup as bs
 import requests
 from requests import get
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import hashlib
+import json
+import shutil
+import tempfile
+import threading
+import time
 import os
 
+STARTING_URL = "http://www.fao.org/ag/locusts/en/archives/archive/index.html"
+ARCHIVE_DOMAIN = "http://www.fao.org/ag/locusts/en/archives"
+FILE_DOMAIN = "http://www.fao.org/ag/locusts"
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 4
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 0.5
+CHUNK_SIZE = 64 * 1024
+TIMEOUT = 60
+MANIFEST_NAME = "manifest.json"
+STORE_DIR = "objects"
 
-def wrapper():
+
+def wrapper(starting_url=STARTING_URL, domain=ARCHIVE_DOMAIN, file_domain=FILE_DOMAIN,
+            max_workers=MAX_WORKERS, requests_per_second=REQUESTS_PER_SECOND):
     '''
     Wrapper function for web scraping. Downloads all locust bulletin files to machine.
+    Year pages and PDFs are fetched concurrently over one shared keep-alive session.
+    Files already in the download manifest are only re-fetched if the server reports a change.
+    Inputs:
+        starting_url (str): the archive index page
+        domain (str): the domain the year page links are relative to
+        file_domain (str): the domain the PDF links are relative to
+        max_workers (int): the maximum number of requests in flight at once
+        requests_per_second (float): the maximum request rate per host
+    Returns:
+        a list of paths of bulletins that are new or changed since the last run
     '''
-    starting_url = "http://www.fao.org/ag/locusts/en/archives/archive/index.html"
-    domain = "http://www.fao.org/ag/locusts/en/archives"
-    to_visit = get_urls_to_visit(starting_url, domain)
-    get_pdfs(to_visit)
+    session = make_session(max_workers)
+    limiter = HostRateLimiter(requests_per_second)
+    to_visit = get_urls_to_visit(starting_url, domain, session, limiter)
 
-    return None
+    return get_pdfs(to_visit, file_domain, session, limiter, max_workers)
+
+
+def make_session(max_workers=MAX_WORKERS):
+    '''
+    Makes a requests session with pooled keep-alive connections
+    and retries with exponential backoff.
+    Inputs:
+        max_workers (int): the number of threads that will share the session
+    Returns:
+        a requests Session object
+    '''
+    retries = Retry(total=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR,
+                    status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers,
+                          max_retries=retries)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+class HostRateLimiter:
+    '''
+    Spaces out requests to the same host so that no host sees more than
+    requests_per_second requests. Safe to share between threads.
+    '''
+    def __init__(self, requests_per_second=REQUESTS_PER_SECOND):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        '''
+        Blocks until a request to the host of url is allowed.
+        Inputs:
+            url (str): the url about to be requested
+        '''
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
 
 
-def get_urls_to_visit(starting_url, domain):
+def fetch(url, session, limiter, **kwargs):
+    '''
+    Requests a url through the shared session once the rate limiter allows it.
+    Inputs:
+        url (str): the url to request
+        session: a requests Session object
+        limiter: a HostRateLimiter object
+    Returns:
+        a requests Response object
+    '''
+    limiter.wait(url)
+    response = session.get(url, timeout=TIMEOUT, **kwargs)
+    response.raise_for_status()
+
+    return response
+
+
+def get_urls_to_visit(starting_url, domain, session=None, limiter=None):
     '''
     Creates dictionary of years and URLs to visit.
     Inputs:
         starting_url (str): the url to start with
         domain (str): the domain of the website
+        session: a requests Session object (defaults to a new session)
+        limiter: a HostRateLimiter object (defaults to a new limiter)
     '''
+    session = session or make_session()
+    limiter = limiter or HostRateLimiter()
     to_visit = {}
-    req = requests.get(starting_url)
+    req = fetch(starting_url, session, limiter)
     soup = bs(req.text, 'html.parser')
     potential_page = soup.find_all('a')
     for page in potential_page:
         link = page.get('href')
         year = page.text
-        if '/archives/archive/' in link and len(year) == 4:
+        if link and '/archives/archive/' in link and len(year) == 4:
             to_visit[year] = domain + link[14:]
             print("added to dict: ", year, ": ", domain + link[14:])
 
     return to_visit
 
 
-def get_pdfs(to_visit):
+def get_pdfs(to_visit, domain=FILE_DOMAIN, session=None, limiter=None, max_workers=MAX_WORKERS):
     '''
     Takes in dictionary of urls to visit and downloads pdfs.
+    Year pages are read concurrently, then every PDF is downloaded concurrently.
+    Requests are conditional on the ETag/Last-Modified recorded in the manifest,
+    so unchanged pages and files are skipped. PDFs are stored once by content hash
+    and linked into the year directories, so duplicates on the site share one copy.
+    A page or PDF that fails is logged and skipped; each finished download is
+    recorded as it completes and the manifest is saved even if the run stops early.
     Inputs:
         to_visit: dictionary of years and urls
+        domain (str): the domain the PDF links are relative to
+        session: a requests Session object (defaults to a new session)
+        limiter: a HostRateLimiter object (defaults to a new limiter)
+        max_workers (int): the maximum number of requests in flight at once
+    Returns:
+        a list of paths of bulletins that are new or changed since the last run
+    '''
+    session = session or make_session(max_workers)
+    limiter = limiter or HostRateLimiter()
+    parent_dir = os.getcwd()
+    manifest = load_manifest(parent_dir)
+    downloads = []
+    last_entries = {}
+    fetched = {}
+    new_files = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            year_pages = list(executor.map(lambda item: try_year_files(item[0], item[1], parent_dir, domain, session,
+                                                                       limiter, manifest['pages'].get(item[1])),
+                                           to_visit.items()))
+            for url, (files, page_entry) in zip(to_visit.values(), year_pages):
+                if page_entry:
+                    manifest['pages'][url] = page_entry
+                downloads.extend(files)
+            targets = {}
+            for year, month, file_path, file_url in downloads:
+                targets.setdefault(file_url, []).append((year, month, file_path))
+                entry = manifest['files'].get(os.path.relpath(file_path, parent_dir))
+                if entry and entry['url'] == file_url:
+                    last_entries[file_url] = entry
+            assigned = {}
+            results = executor.map(
+                lambda file_url: try_download(file_url, parent_dir, session, limiter, last_entries.get(file_url)),
+                targets)
+            for file_url, (ok, entry) in zip(targets, results):
+                if not ok:
+                    continue
+                fetched[file_url] = entry or last_entries[file_url] # None means unchanged since last run
+                new_files.extend(record_file(manifest, parent_dir, targets[file_url], fetched[file_url], assigned))
+    finally:
+        manifest['index'] = {}
+        for year, month, file_path, file_url in downloads:
+            entry = fetched.get(file_url) or last_entries.get(file_url) # a failed file keeps its last copy
+            if entry:
+                manifest['index'].setdefault(year, {}).setdefault(month or os.path.basename(file_path),
+                                                                  []).append(entry['sha256'])
+        save_manifest(manifest, parent_dir)
+    for digest, paths in find_duplicates(manifest).items():
+        print("duplicate bulletin ", digest[:12], " stored once for: ", ", ".join(paths))
+
+    return new_files
+
+
+def record_file(manifest, parent_dir, targets, entry, assigned):
+    '''
+    Links a downloaded PDF into the year directories it belongs in and records it in the manifest.
+    Inputs:
+        manifest: a manifest dictionary
+        parent_dir (str): the directory year directories are created in
+        targets: a list of (year, month, file path) tuples the PDF is linked to
+        entry: the manifest record for the PDF
+        assigned: a dictionary of paths and the sha256 digests given to them this run
+    Returns:
+        a list of paths of bulletins that are new or changed since the last run
+    '''
+    new_files = []
+    for year, month, file_path in targets:
+        rel_path = os.path.relpath(file_path, parent_dir)
+        if rel_path in assigned and assigned[rel_path] != entry['sha256']:
+            print("WARNING: two different files named ", rel_path, "; keeping ", entry['url'])
+        assigned[rel_path] = entry['sha256']
+        old_entry = manifest['files'].get(rel_path)
+        changed = not old_entry or old_entry['sha256'] != entry['sha256']
+        if changed or not os.path.exists(file_path):
+            link_object(object_path(parent_dir, entry['sha256']), file_path)
+        manifest['files'][rel_path] = dict(entry, year=year, month=month)
+        if changed:
+            new_files.append(file_path)
+
+    return new_files
+
+
+def try_year_files(year, url, parent_dir, domain, session, limiter, page_entry=None):
+    '''
+    Reads one year page like get_year_files, but logs a failure instead of raising.
+    A page that cannot be read falls back to the links recorded in the manifest.
+    Inputs:
+        the same as get_year_files
+    Returns:
+        files: a list of (year, month, file path, file url) tuples
+        page_entry: the updated manifest record for this page, or None if it failed
+    '''
+    try:
+        return get_year_files(year, url, parent_dir, domain, session, limiter, page_entry)
+    except (requests.RequestException, OSError) as e:
+        print("ERROR: could not read ", url, ": ", e)
+        return [tuple(item) for item in page_entry['files']] if page_entry else [], None
+
+
+def try_download(file_url, parent_dir, session, limiter, entry=None):
+    '''
+    Downloads one file like download_file, but logs a failure instead of raising,
+    so one missing PDF does not stop the rest of the run.
+    Inputs:
+        the same as download_file
+    Returns:
+        ok (bool): whether the file was downloaded or found unchanged
+        the new manifest record for the file, or None if it was unchanged or failed
+    '''
+    try:
+        return True, download_file(file_url, parent_dir, session, limiter, entry)
+    except (requests.RequestException, OSError) as e:
+        print("ERROR: could not download ", file_url, ": ", e)
+        return False, None
+
+
+def object_path(parent_dir, digest):
+    '''
+    Gives the location of a PDF in the content-addressed store.
+    Inputs:
+        parent_dir (str): the directory year directories are created in
+        digest (str): the sha256 hex digest of the PDF
+    Returns:
+        the path of the stored PDF
+    '''
+    return os.path.join(parent_dir, STORE_DIR, digest[:2], digest + ".pdf")
+
+
+def link_object(obj_path, file_path):
+    '''
+    Points a year/month file name at a stored PDF. Uses a hard link so
+    duplicates take no extra space, falling back to a copy.
+    Inputs:
+        obj_path (str): the path of the stored PDF
+        file_path (str): the year/month path the bulletin should appear at
+    '''
+    tmp_path = file_path + ".link"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(obj_path, tmp_path)
+    except OSError:
+        shutil.copyfile(obj_path, tmp_path)
+    os.replace(tmp_path, file_path)
+
+    return None
+
+
+def find_duplicates(manifest):
+    '''
+    Finds stored PDFs that appear under more than one year/month name.
+    Inputs:
+        manifest: a manifest dictionary
+    Returns:
+        a dictionary of sha256 digests and the list of paths sharing them
+    '''
+    by_digest = {}
+    for rel_path, entry in sorted(manifest['files'].items()):
+        by_digest.setdefault(entry['sha256'], []).append(rel_path)
+
+    return {digest: paths for digest, paths in by_digest.items() if len(paths) > 1}
+
+
+def load_manifest(parent_dir):
+    '''
+    Loads the download manifest kept next to the year directories.
+    Inputs:
+        parent_dir (str): the directory year directories are created in
+    Returns:
+        a dictionary with 'pages' (year page url -> validators and links) and
+        'files' (path relative to parent_dir -> file record)
+    '''
+    manifest_path = os.path.join(parent_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {'pages': {}, 'files': {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, parent_dir):
+    '''
+    Writes the download manifest next to the year directories.
+    Inputs:
+        manifest: a manifest dictionary
+        parent_dir (str): the directory year directories are created in
     '''
-    domain = "http://www.fao.org/ag/locusts"
-    for year, url in to_visit.items():
-        filetype = ".pdf"
-        req = requests.get(url)
-        soup = bs(req.text, 'html.parser')
-        links = soup.find_all('a')
-        parent_dir = os.getcwd()
-        new_dir = os.path.join(parent_dir, year)
-        if not os.path.exists(new_dir):
-            os.mkdir(new_dir)
-
-        months = ["JAN", "FEB", "MAR", "APR", "MAY", "JUNE", "JULY", "AUG", "SEPT", "OCT", "NOV", "DEC"]
-        month_tracker = 0 # start at JAN, but traverse list of links backward
-        if year == "1978": # 1978 data starts in September
-            month_tracker = 8
-
-        for link in reversed(links):
-            file_link = link.get('href')
-            if filetype in file_link and link.text == "english":
-                file_name = file_link[33:]
-                print("og file_name is: ", file_name)
-                if "PR" not in file_name:
-                    if year == "1987" and month_tracker == 0: # JAN AND FEB combine for 1987
-                        file_name = "/JAN_FEB_" + year
-                        month_tracker = month_tracker + 2
-                    else:
-                        if year == "1988" and month_tracker == 4: # 1988 is missing May, skip to June
-                            month_tracker = month_tracker + 1
-                        file_name = "/" + months[month_tracker] + "_" + year
-                        print("file_name changed to: ", file_name)
-                        month_tracker = month_tracker + 1 # iterate forward through months
-                with open(new_dir + file_name, 'wb') as file:
-                    file_path = domain + file_link[14:]
-                    response = requests.get(file_path)
-                    file.write(response.content)
-            else:
-                continue
+    manifest_path = os.path.join(parent_dir, MANIFEST_NAME)
+    with open(manifest_path + ".part", 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + ".part", manifest_path)
 
     return None
+
+
+def conditional_headers(entry):
+    '''
+    Builds conditional request headers from a manifest record.
+    Inputs:
+        entry: a manifest record, or None
+    Returns:
+        a dictionary of headers
+    '''
+    headers = {}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    return headers
+
+
+def get_year_files(year, url, parent_dir, domain, session, limiter, page_entry=None):
+    '''
+    Reads one year page and works out where each of its PDFs should be saved.
+    If the page is unchanged since the last run, reuses the links recorded in the manifest.
+    Inputs:
+        year (str): the year of the page
+        url (str): the url of the year page
+        parent_dir (str): the directory year directories are created in
+        domain (str): the domain the PDF links are relative to
+        session: a requests Session object
+        limiter: a HostRateLimiter object
+        page_entry: the manifest record for this page from the last run, or None
+    Returns:
+        files: a list of (year, month, file path, file url) tuples
+        page_entry: the updated manifest record for this page
+    '''
+    filetype = ".pdf"
+    new_dir = os.path.join(parent_dir, year)
+    os.makedirs(new_dir, exist_ok=True)
+    req = fetch(url, session, limiter, headers=conditional_headers(page_entry))
+    if req.status_code == 304:
+        return [tuple(item) for item in page_entry['files']], page_entry
+    soup = bs(req.text, 'html.parser')
+    links = soup.find_all('a')
+
+    months = ["JAN", "FEB", "MAR", "APR", "MAY", "JUNE", "JULY", "AUG", "SEPT", "OCT", "NOV", "DEC"]
+    month_tracker = 0 # start at JAN, but traverse list of links backward
+    if year == "1978": # 1978 data starts in September
+        month_tracker = 8
+
+    files = []
+    for link in reversed(links):
+        file_link = link.get('href')
+        if file_link and filetype in file_link and link.text == "english":
+            file_name = file_link[33:]
+            month = None
+            print("og file_name is: ", file_name)
+            if "PR" not in file_name:
+                if year == "1987" and month_tracker == 0: # JAN AND FEB combine for 1987
+                    month = "JAN_FEB"
+                    file_name = "/JAN_FEB_" + year
+                    month_tracker = month_tracker + 2
+                else:
+                    if year == "1988" and month_tracker == 4: # 1988 is missing May, skip to June
+                        month_tracker = month_tracker + 1
+                    month = months[month_tracker]
+                    file_name = "/" + months[month_tracker] + "_" + year
+                    print("file_name changed to: ", file_name)
+                    month_tracker = month_tracker + 1 # iterate forward through months
+            files.append((year, month, new_dir + file_name, domain + file_link[14:]))
+    page_entry = {'etag': req.headers.get('ETag'),
+                  'last_modified': req.headers.get('Last-Modified'),
+                  'files': files}
+
+    return files, page_entry
+
+
+def download_file(file_url, parent_dir, session, limiter, entry=None):
+    '''
+    Streams a file into the content-addressed store in chunks. Writes to a
+    temporary file first so an interrupted download never leaves a partial
+    bulletin behind, and only keeps one copy of identical bytes.
+    If the file is already stored, the request is made conditional on its manifest record.
+    Inputs:
+        file_url (str): the url of the file
+        parent_dir (str): the directory year directories are created in
+        session: a requests Session object
+        limiter: a HostRateLimiter object
+        entry: the manifest record for this url from the last run, or None
+    Returns:
+        the new manifest record for the file, or None if it was unchanged
+    '''
+    stored = entry and os.path.exists(object_path(parent_dir, entry['sha256']))
+    headers = conditional_headers(entry) if stored else {}
+    store_dir = os.path.join(parent_dir, STORE_DIR)
+    os.makedirs(store_dir, exist_ok=True)
+    sha256 = hashlib.sha256()
+    size = 0
+    with fetch(file_url, session, limiter, stream=True, headers=headers) as response:
+        if response.status_code == 304:
+            return None
+        fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=store_dir)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    file.write(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+        except BaseException: # don't leave a partial download in the store
+            os.remove(tmp_path)
+            raise
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+    digest = sha256.hexdigest()
+    obj_path = object_path(parent_dir, digest)
+    if not os.path.exists(obj_path):
+        os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+        try:
+            os.link(tmp_path, obj_path) # unlike a rename, never replaces a copy another thread stored first
+            print("downloaded: ", file_url)
+        except FileExistsError: # identical bytes stored concurrently
+            pass
+        except OSError: # the filesystem has no hard links
+            os.replace(tmp_path, obj_path)
+            print("downloaded: ", file_url)
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    if stored and entry['sha256'] == digest:
+        return None
+
+    return {'url': file_url, 'size': size, 'etag': etag, 'last_modified': last_modified,
+            'sha256': digest,
+            'downloaded': datetime.now(timezone.utc).isoformat(timespec='seconds')}
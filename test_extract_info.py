@@ -0,0 +1,141 @@
+'''
+Tests for extract_info. They need the spaCy model, and are skipped without it.
+'''
+import numpy as np
+import pandas as pd
+import pytest
+from spacy.pipeline import EntityRuler
+
+import benchmarks
+import extract_info
+
+
+@pytest.fixture(scope='module')
+def nlp():
+    try:
+        return extract_info.get_nlp()
+    except OSError:
+        pytest.skip('the spaCy model ' + extract_info.MODEL + ' is not installed')
+
+
+def test_annotate_texts_converts_each_distinct_doc_once(nlp):
+    texts = ['Hoppers were seen near Tamanrasset in May.', 'No significant developments are likely.',
+             'Hoppers were seen near Tamanrasset in May.', 'No significant developments are likely.',
+             'No locusts were reported during June.', 'No locusts were reported during July.', '']
+    converted = []
+
+    def convert(doc):
+        converted.append(doc.text)
+        return ('compact', doc.text)
+
+    results = list(extract_info.annotate_texts(texts, use_cache=False, convert=convert))
+    assert results == [('compact', text) for text in texts]
+    assert sorted(converted) == sorted(set(texts))
+    assert results[0] is results[2]
+
+
+
+def bulletin_frame():
+    '''
+    A few rows like report_text.csv, with an empty forecast, a missing situation,
+    an all-missing column and an index that doesn't start at 0.
+    '''
+    return pd.DataFrame({'YEAR': [2004, 2004, 2005], 'MONTH': ['JULY', 'AUG', 'JAN'],
+                         'COUNTRY': ['ALGERIA', 'ALGERIA', 'NIGER'],
+                         'SITUATION': ['Scattered adults persisted in Tamesna.', np.nan,
+                                       'Hopper bands declined near Tamanrasset.'],
+                         'FORECAST': ['Small groups of adults are likely to decline.', '',
+                                      'No significant developments are likely.'],
+                         'REGION': [np.nan, np.nan, np.nan]}, index=[10, 11, 12])
+
+
+def test_annotate_features_on_a_mixed_dtype_frame(nlp):
+    df = bulletin_frame()
+    texts = [str(text) for text in list(df['SITUATION']) + list(df['FORECAST'])]
+    expected = [extract_info.compact_doc(doc) if doc else None
+                for doc in extract_info.annotate_texts(texts, use_cache=False)]
+    annotated = extract_info.annotate_features(df.copy(), use_cache=False)
+    assert list(annotated.index) == [10, 11, 12]
+    assert list(annotated['SITUATION']) + list(annotated['FORECAST']) == expected
+    assert isinstance(annotated.loc[10, 'SITUATION'], extract_info.CompactDoc)
+    assert annotated.loc[11, 'FORECAST'] is None
+    assert annotated[['YEAR', 'MONTH', 'COUNTRY']].equals(df[['YEAR', 'MONTH', 'COUNTRY']])
+
+
+def doc_annotations(doc):
+    if doc is None:
+        return None
+    return extract_info.compact_doc(doc), [(token.text, token.lemma_, token.tag_, token.dep_) for token in doc]
+
+
+@pytest.mark.parametrize('workers, use_cache', [(1, False), (2, False), (1, True)])
+def test_annotate_matches_the_pipeline_through_a_frame(nlp, tmp_path, monkeypatch, workers, use_cache):
+    monkeypatch.chdir(tmp_path) # a fresh doc cache
+    df = bulletin_frame()
+    texts = [str(text) for text in list(df['SITUATION']) + list(df['FORECAST'])]
+    expected = [doc_annotations(nlp(text)) if text else None for text in texts]
+    for run in range(2 if use_cache else 1): # with the cache: filled, then read
+        annotated = extract_info.annotate(df.copy(), workers=workers, use_cache=use_cache)
+        assert list(annotated.index) == [10, 11, 12]
+        assert [doc_annotations(doc) for doc in list(annotated['SITUATION']) + list(annotated['FORECAST'])] == expected
+
+
+def test_get_snippets_fills_both_columns(nlp):
+    df = bulletin_frame()
+    annotated = extract_info.get_snippets(df.copy(), 'FORECAST', 'FORECAST_SNIPPETS')
+    assert [doc.text if doc else doc for doc in annotated['FORECAST']] == [df.loc[10, 'FORECAST'], None,
+                                                                           df.loc[12, 'FORECAST']]
+    assert annotated.loc[11, 'FORECAST_SNIPPETS'] is None
+    for doc, snippets in zip(annotated.loc[[10, 12], 'FORECAST'], annotated.loc[[10, 12], 'FORECAST_SNIPPETS']):
+        assert [[ent.text for ent in sent] for sent in snippets] == [[ent.text for ent in sent.ents]
+                                                                     for sent in doc.sents]
+
+def test_month_variants_match_the_pipeline(nlp):
+    texts = ['No locusts were reported during ' + month + '.' for month in extract_info.MONTHS] + \
+        ['NO LOCUSTS WERE REPORTED DURING December.', 'No locusts were reported during December and January.']
+    annotated = extract_info.annotate_texts(texts, use_cache=False)
+    assert [doc_annotations(doc) for doc in annotated] == [doc_annotations(nlp(text)) for text in texts]
+
+
+def test_entity_attributes_match_the_separate_components(nlp):
+    texts = ['Scattered adults persisted in Tamesna and hopper bands declined near Tamanrasset.',
+             'Small groups of hoppers and adults are likely to decline in the southwest.']
+    chain_docs, seconds = benchmarks.run_chain(nlp, texts)
+    fused_docs = list(nlp.pipe(texts))
+    assert [benchmarks.attribute_tuples(doc) for doc in fused_docs] == \
+        [benchmarks.attribute_tuples(doc) for doc in chain_docs]
+    ents = [ent for doc in fused_docs for ent in doc.ents]
+    assert any(ent._.subject_decline for ent in ents)
+    assert any(ent._.contains_adults for ent in ents)
+    assert any(token._.is_solitarious for doc in fused_docs for token in doc)
+
+
+def ruler_doc(nlp, text):
+    '''
+    Tags "immature and mature adults" and "declined" as entities with one ruler,
+    then widens the first to "Scattered immature and mature adults" with a second
+    that overwrites entities, the way combine_ruler does. No statistical model is used.
+    '''
+    doc = nlp.make_doc(text)
+    for token in doc:
+        token.lemma_ = 'decline' if token.lower_ == 'declined' else token.lower_
+    ruler = EntityRuler(nlp, patterns=[
+        {'label': 'LOC_TYPE', 'pattern': [{'LOWER': 'immature'}, {'LOWER': 'and'}, {'LOWER': 'mature'},
+                                          {'LOWER': 'adults'}]},
+        {'label': 'ACTION', 'pattern': [{'LOWER': 'declined'}]}])
+    widening_ruler = EntityRuler(nlp, overwrite_ents=True, patterns=[
+        {'label': 'LOC_TYPE', 'pattern': [{'LOWER': 'scattered'}, {'ENT_TYPE': 'LOC_TYPE', 'OP': '+'}]}])
+    return ruler(doc), widening_ruler
+
+
+def test_entity_attributes_keep_subject_decline_on_widened_entities(nlp):
+    text = 'Scattered immature and mature adults declined in North Kordofan.'
+    # marked before widening, as the old chain did: the mark stays on the narrower span
+    chain_doc, widening_ruler = ruler_doc(nlp, text)
+    chain_doc = widening_ruler(benchmarks.chain_subject_decline(chain_doc))
+    assert [(ent.text, ent._.subject_decline) for ent in chain_doc.ents] == \
+        [('Scattered immature and mature adults', False), ('declined', False)]
+    doc, widening_ruler = ruler_doc(nlp, text)
+    doc = extract_info.entity_attributes(widening_ruler(doc))
+    assert [(ent.text, ent._.subject_decline) for ent in doc.ents] == \
+        [('Scattered immature and mature adults', True), ('declined', False)]
@@ -0,0 +1,95 @@
+'''
+Tests for get_text.
+'''
+import random
+import re
+
+import get_text
+
+# The normalization chain get_relevant_text used before the rule table, one re.sub per rule.
+OLD_CHAIN = [
+    (r'\(cid:127\)', r'• ', 0),
+    (r'\n( +)?•( +)?F( +)?(\n)?orecaSt\n', r'\n• FORECAST\n', re.IGNORECASE),
+    (r'\n- SITUATION\n', r'\n• SITUATION\n', re.IGNORECASE),
+    (r'\n( +)?•( +)?S( +)?\n?ituation\n', r'\n• SITUATION\n', re.IGNORECASE),
+    (r'\n( +)?• S( +)?\n?ituation\n', r'\n• SITUATION\n', re.IGNORECASE),
+    (r'dekad', r'decade', 0),
+    (r' sq.', r' sq', 0),
+    (r' m.', r' m', 0),
+    (r' Sh.', r' Sh', 0),
+    (r' mtur', r' matur', 0),
+    (r' md-', r'mid-', 0),
+    (r'mderate', r'moderate', 0),
+    (r'\bmnth\b', r' month', 0),
+    (r'(\b)mre(\b)', r'(\1)more(\2)', 0),
+    (r'(\b)mde(\b)', r'\1made\2', 0),
+    (r' (mve)(s?) ', r' move\2', 0),
+    (r'(signifi) +(cant)', r'\1\2', 0),
+    (r'signiﬁ +cant', r'significant', 0),
+    (r'N +o significant', r'No significant', 0),
+]
+
+FRAGMENTS = [' ', '\n', '.', '-', 'made', 'mid-', 'more', 'md-', 'mre', 'mde', 'month', 'mnth', 'mderate',
+             'moderate', 'mature', 'move', 'moves', 'mve', 'no', 'No', 'N  o significant', 'signifi  cant',
+             'sq.', 'Sh.', 'dekad', '(cid:127)', '• Forecast', '• Situation', '- SITUATION', 'April', 'June',
+             'Hoppers', 'were', 'locusts']
+
+
+def old_normalize(text):
+    for pattern, replacement, flags in OLD_CHAIN:
+        text = re.sub(pattern, replacement, text, flags=flags)
+    return text
+
+
+def new_normalize(text):
+    for rule_pass in get_text.NORMALIZATION_PASSES:
+        text = get_text.apply_pass(rule_pass, text)
+    return text
+
+
+def test_normalization_matches_old_chain_on_known_cases():
+    for text in ['Hoppers were made mid-April.', 'no more mid-June', 'mre md-May and mde md-July',
+                 'no more months of moderate movement.', '\n • Forecast\nNo significant developments.']:
+        assert new_normalize(text) == old_normalize(text)
+
+
+def test_normalization_matches_old_chain_on_random_text():
+    rng = random.Random(0)
+    for _ in range(5000):
+        text = ''.join(rng.choice(FRAGMENTS) + rng.choice(['', ' ']) for _ in range(rng.randint(1, 15)))
+        assert new_normalize(text) == old_normalize(text), repr(text)
+
+
+class FakePDF:
+    def __init__(self, n_pages):
+        self.pages = [None] * n_pages
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def test_iter_page_text_closes_pdf_when_stopped_early(tmp_path, monkeypatch):
+    file_path = tmp_path / 'JAN_2000'
+    file_path.write_bytes(b'%PDF')
+    pdf = FakePDF(3)
+    monkeypatch.setattr(get_text.pdfplumber, 'open', lambda path: pdf)
+    monkeypatch.setattr(get_text, 'get_columns', lambda *args: ('left', 'right'))
+    pages = get_text.iter_page_text(str(file_path), use_cache=False)
+    next(pages)
+    assert not pdf.closed
+    pages.close()
+    assert pdf.closed
+
+
+def test_geometry_key_changes_with_the_pdfplumber_version(monkeypatch):
+    key = get_text.geometry_key('bulletins/2000/JAN_2000')
+    assert get_text.geometry_key('bulletins/2000/JAN_2000') == key
+    monkeypatch.setattr(get_text.pdfplumber, '__version__', get_text.pdfplumber.__version__ + '.post1')
+    assert get_text.geometry_key('bulletins/2000/JAN_2000') != key
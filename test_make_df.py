@@ -0,0 +1,93 @@
+'''
+Tests for make_df.
+'''
+import random
+
+import benchmarks
+import make_df
+
+NAMES = ['CHAD', 'SUDAN', 'MALI, NIGER AND CHAD', 'WESTERN REGION\nMAURITANIA', 'SYRIA\nAND TURKEY']
+SENTENCES = ['No significant developments are likely.', 'Scattered adults were seen in the north',
+             'Small groups may form.', 'Hoppers were treated (1200 ha)', '• Locusts', 'FORECAST', 'ok']
+SITUATION_LINES = ['• SITUATION', '  • SITUATION', '• situation ', '- SITUATION']
+FORECAST_LINES = ['• FORECAST', '  • FORECAST', '• forecast ', '• FORECAST  ', '•FORECAST']
+
+
+def test_get_countries_keeps_last_country_with_empty_situation():
+    text = 'MALI\n• SITUATION\nAdults seen.\n• FORECAST\nBreeding.\nCHAD\n• SITUATION\n• FORECAST\nNone.'
+    expected = [('MALI', 'Adults seen.', 'Breeding.'), ('\nCHAD\n• SITUATION', '', 'None.')]
+    assert make_df.get_countries(text) == expected == benchmarks.regex_get_countries(text)
+
+
+def test_get_countries_skips_trailing_forecast_marker():
+    for text in ['MALI\n• SITUATION\nAdults seen.\n• FORECAST\nBreeding.\nCHAD\n• SITUATION\nQuiet.\n• FORECAST\n',
+                 'MALI\n• SITUATION\nAdults seen.\n• FORECAST\nBreeding.\nCHAD\n• SITUATION\nQuiet.\n• FORECAST']:
+        expected = [('MALI', 'Adults seen.', 'Breeding.')]
+        assert make_df.get_countries(text) == expected == benchmarks.regex_get_countries(text)
+
+
+def test_get_countries_skips_situation_ending_at_trailing_forecast_marker():
+    text = 'SUDAN\n• situation \n• forecast \n• Locusts\nNo significant developments are likely.\nEGYPT\n- SITUATION\n  • FORECAST\n'
+    assert make_df.get_countries(text) == benchmarks.regex_get_countries(text)
+    assert make_df.get_countries(text)[0][0] == 'SUDAN\n• situation '
+
+
+def test_get_countries_matches_regex_on_random_bulletins():
+    rng = random.Random(0)
+    for _ in range(3000):
+        parts = []
+        for _ in range(rng.randint(1, 5)):
+            parts.append(rng.choice(NAMES))
+            if rng.random() < 0.8:
+                parts.append(rng.choice(SITUATION_LINES))
+                parts.extend(rng.choice(SENTENCES) for _ in range(rng.randint(0, 3)))
+            parts.append(rng.choice(FORECAST_LINES) if rng.random() < 0.95 else rng.choice(SITUATION_LINES))
+            parts.extend(rng.choice(SENTENCES) for _ in range(rng.randint(0, 3)))
+        text = '\n'.join(parts) + rng.choice(['', '\n', '.\n'])
+        assert make_df.get_countries(text) == benchmarks.regex_get_countries(text), repr(text)
+
+
+BULLETIN = '\n'.join(['MAURITANIA', '• SITUATION', 'Scattered adults were seen in the north.', '• FORECAST',
+                      'Small-scale breeding will occur.', 'MALI, NIGER AND CHAD', '• SITUATION',
+                      'No locusts were reported.', '• FORECAST', 'No significant developments are likely.',
+                      'EASTERN REGION', 'IRAN', '• SITUATION', 'Hoppers were treated (1200 ha).', '• FORECAST',
+                      'Locust numbers will decline.'])
+
+
+def test_parse_text_prepares_each_row_once(monkeypatch):
+    calls = []
+    prep_text = make_df.prep_text
+
+    def counting_prep_text(year, month, text):
+        calls.append((year, month, text))
+        return prep_text(year, month, text)
+
+    monkeypatch.setattr(make_df, 'clean_page', lambda file_path, columns_text=None: BULLETIN)
+    monkeypatch.setattr(make_df, 'prep_text', counting_prep_text)
+    df = make_df.parse_text('root/2005/JUL_2005')
+    assert list(df['COUNTRY']) == ['MAURITANIA', 'MALI', 'NIGER', 'CHAD', 'IRAN']
+    assert len(calls) == 2 * len(df)
+    assert all(year == 2005 and month == 'JUL' for year, month, text in calls)
+
+
+def test_make_csv_hashes_each_file_once_and_keeps_crop_geometries_apart(tmp_path, monkeypatch):
+    # identical bytes everywhere; SEPT_2006 is cropped differently from the other 2006 bulletins
+    file_paths = ['root/2006/AUG_2006', 'root/2006/SEPT_2006', 'root/2006/OCT_2006']
+    hashed = []
+    extracted = []
+
+    def file_digest(file_path):
+        hashed.append(file_path)
+        return 'same bytes'
+
+    def extract_section(file_path, use_cache=True, digest=None):
+        extracted.append((file_path, digest))
+        return file_path
+
+    monkeypatch.setattr(make_df, 'get_file_paths', lambda root_dir: file_paths)
+    monkeypatch.setattr(make_df, 'file_digest', file_digest)
+    monkeypatch.setattr(make_df, 'extract_section', extract_section)
+    monkeypatch.setattr(make_df, 'clean_page', lambda file_path, columns_text=None: BULLETIN)
+    make_df.make_csv('root', str(tmp_path / 'report_text.csv'), parquet_path=None)
+    assert hashed == file_paths
+    assert extracted == [('root/2006/AUG_2006', 'same bytes'), ('root/2006/SEPT_2006', 'same bytes')]
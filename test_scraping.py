@@ -0,0 +1,148 @@
+'''
+Tests for scraping, against a fake bulletin archive served from a local http.server.
+'''
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import scraping
+
+ARCHIVE_PATH = '/ag/locusts/en/archives/archive/'
+FILE_PREFIX = '/ag/locusts/common/ecg/bulletins/en'
+
+
+class FakeArchive(BaseHTTPRequestHandler):
+    '''
+    Serves the pages and PDFs in the server's routes, answering conditional requests with 304
+    and failing a path with the statuses queued in the server's failures.
+    '''
+    def do_GET(self):
+        self.server.hits.append((self.path, self.headers.get('If-None-Match')))
+        failures = self.server.failures.get(self.path)
+        if failures:
+            self.send_response(failures.pop(0))
+            self.send_header('Content-Length', '0')
+            return self.end_headers()
+        if self.path not in self.server.routes:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            return self.end_headers()
+        body = self.server.routes[self.path]
+        etag = '"' + str(hash(body)) + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            return self.end_headers()
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def year_page(year, file_names):
+    '''
+    Builds a year page linking file_names, listed latest first like the archive.
+    '''
+    links = ''.join('<a href="' + FILE_PREFIX + '/' + name + '">english</a>' for name in reversed(file_names))
+    return ('<html><body><h1>' + year + '</h1>' + links + '</body></html>').encode('utf-8')
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    '''
+    Starts a fake archive with one year and two PDFs and runs each test in an empty directory.
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeArchive)
+    server.daemon_threads = True
+    server.base = 'http://127.0.0.1:' + str(server.server_port)
+    server.hits = []
+    server.failures = {}
+    server.routes = {
+        ARCHIVE_PATH + 'index.html': ('<a href="' + ARCHIVE_PATH + '2000/index.html">2000</a>').encode('utf-8'),
+        ARCHIVE_PATH + '2000/index.html': year_page('2000', ['DL256e.pdf', 'DL257e.pdf']),
+        '/ag/locusts' + FILE_PREFIX[14:] + '/DL256e.pdf': b'%PDF january',
+        '/ag/locusts' + FILE_PREFIX[14:] + '/DL257e.pdf': b'%PDF february',
+    }
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(scraping, 'BACKOFF_FACTOR', 0)
+    monkeypatch.chdir(tmp_path)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def sync(site):
+    '''
+    Runs a full scrape of the fake archive.
+    '''
+    return scraping.wrapper(site.base + ARCHIVE_PATH + 'index.html', site.base + '/ag/locusts/en',
+                            site.base + '/ag/locusts', max_workers=4, requests_per_second=0)
+
+
+def pdf_path(name):
+    return '/ag/locusts' + FILE_PREFIX[14:] + '/' + name
+
+
+def read_manifest():
+    with open(scraping.MANIFEST_NAME) as f:
+        return json.load(f)
+
+
+def test_failed_pdf_keeps_the_rest_of_the_manifest(site):
+    del site.routes[pdf_path('DL257e.pdf')]
+    new_files = sync(site)
+    assert [os.path.basename(path) for path in new_files] == ['JAN_2000']
+    manifest = read_manifest()
+    assert sorted(manifest['files']) == [os.path.join('2000', 'JAN_2000')]
+    assert manifest['index'] == {'2000': {'JAN': [manifest['files'][os.path.join('2000', 'JAN_2000')]['sha256']]}}
+    assert not os.path.exists(os.path.join('2000', 'FEB_2000'))
+    assert not [name for root, dirs, names in os.walk(scraping.STORE_DIR) for name in names
+                if name.endswith('.part')]
+
+    site.routes[pdf_path('DL257e.pdf')] = b'%PDF february'
+    new_files = sync(site)
+    assert [os.path.basename(path) for path in new_files] == ['FEB_2000']
+    assert sorted(read_manifest()['files']) == [os.path.join('2000', 'FEB_2000'), os.path.join('2000', 'JAN_2000')]
+
+
+def stored_objects():
+    return sorted(name for root, dirs, names in os.walk(scraping.STORE_DIR) for name in names)
+
+
+def test_server_errors_are_retried(site):
+    site.failures[pdf_path('DL256e.pdf')] = [503, 502]
+    new_files = sync(site)
+    assert sorted(os.path.basename(path) for path in new_files) == ['FEB_2000', 'JAN_2000']
+    assert [path for path, etag in site.hits].count(pdf_path('DL256e.pdf')) == 3
+    with open(os.path.join('2000', 'JAN_2000'), 'rb') as f:
+        assert f.read() == b'%PDF january'
+
+
+def test_unchanged_pages_and_pdfs_are_replayed_from_the_manifest(site):
+    sync(site)
+    manifest = read_manifest()
+    site.hits.clear()
+    assert sync(site) == []
+    conditional = {path: etag for path, etag in site.hits if path != ARCHIVE_PATH + 'index.html'}
+    assert sorted(conditional) == sorted([ARCHIVE_PATH + '2000/index.html', pdf_path('DL256e.pdf'),
+                                          pdf_path('DL257e.pdf')])
+    assert all(conditional.values()) # every request carried If-None-Match and was answered 304
+    assert read_manifest()['index'] == manifest['index']
+    with open(os.path.join('2000', 'FEB_2000'), 'rb') as f:
+        assert f.read() == b'%PDF february'
+
+
+def test_identical_pdfs_are_stored_once(site):
+    site.routes[pdf_path('DL257e.pdf')] = b'%PDF january'
+    sync(site)
+    assert len(stored_objects()) == 1
+    assert os.stat(os.path.join('2000', 'JAN_2000')).st_ino == os.stat(os.path.join('2000', 'FEB_2000')).st_ino
+    assert list(scraping.find_duplicates(read_manifest()).values()) == [[os.path.join('2000', 'FEB_2000'),
+                                                                         os.path.join('2000', 'JAN_2000')]]
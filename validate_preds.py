@@ -2,6 +2,7 @@ import spacy
 import pandas as pd
 from fuzzywuzzy import fuzz
 from location_matching import match_places
+from extract_info import CompactDoc, Entity
 from dateutil.relativedelta import relativedelta
 
 
@@ -55,7 +56,7 @@ def results_by_sentence(pred, sit_1, sit_2, match_type='general_type', loc_match
     results = []
     situations = []
     for sit in [sit_1, sit_2]:
-        if type(sit) == spacy.tokens.doc.Doc:
+        if is_doc(sit):
             for sent in sit.sents:
                 situations.extend(get_data(sent, granular=True))
     pos_preds = []
@@ -165,7 +166,7 @@ def get_tuple_list(pred, sit_1, sit_2):
     for sent in pred.sents:
         predictions.extend(get_data(sent, granular=True))
     for sit in [sit_1, sit_2]:
-        if type(sit) == spacy.tokens.doc.Doc:
+        if is_doc(sit):
             for sent in sit.sents:
                 situations.extend(get_data(sent, granular=True))
 
@@ -215,13 +216,13 @@ def granular_corroborate(pred, sit_1, sit_2, match_type='general_type', loc_matc
     '''
     results = []
     predictions = []
-    if all((type(item) != spacy.tokens.doc.Doc) for item in [pred, sit_1, sit_2]):
+    if all(not is_doc(item) for item in [pred, sit_1, sit_2]):
         return []
     for sent in pred.sents:
         predictions.extend(get_data(sent, granular=True))
     situations = []
     for sit in [sit_1, sit_2]:
-        if type(sit) == spacy.tokens.doc.Doc:
+        if is_doc(sit):
             for sent in sit.sents:
                 situations.extend(get_data(sent, granular=True))
     if predictions and not situations: # case where there is no situation report and pred is nothing significant will happen
@@ -357,10 +358,20 @@ def compare_one_granular(pred, situations, match_type='general_type', loc_matchi
     return False
 
 
+def is_doc(item):
+    '''
+    Returns whether an item is an annotated doc: a spaCy doc, or the
+    CompactDoc of its features made by extract_info.annotate_features
+    '''
+    return isinstance(item, (spacy.tokens.doc.Doc, CompactDoc))
+
+
 def is_negated(ent):
     '''
     Returns whether an ent is negated (i.e., 'no locusts')
     '''
+    if isinstance(ent, Entity):
+        return ent.negation
     return ent[0].text.lower().startswith('no ')
 
 def get_data(sent, granular=False):